@@ -0,0 +1,159 @@
+from array import array
+from opt import to_int64
+
+# Nodes sit in preorder, so the first child of a + or let is always the next
+# node and only the last child needs an index:
+#   INT   arg = value, wrapped to 64 bits like the compiled code does
+#   VAR   arg = name id
+#   READ
+#   ADD   child = index of arg2 (arg1 is at index + 1)
+#   LET   arg = name id of the bound var, child = index of the body (value is at index + 1)
+INT, VAR, READ, ADD, LET = range(5)
+
+class Arena:
+
+    def __init__(self):
+        self.kind = array("B")
+        self.arg = array("q")
+        self.child = array("q")
+        self.names = []
+        self.name_id_dict = {}
+
+    def __len__(self):
+        return len(self.kind)
+
+    def name_id(self, name):
+        if name not in self.name_id_dict:
+            self.name_id_dict[name] = len(self.names)
+            self.names.append(name)
+        return self.name_id_dict[name]
+
+    def new_node(self, kind, arg=0):
+        self.kind.append(kind)
+        self.arg.append(arg)
+        self.child.append(0)
+        return len(self.kind) - 1
+
+    def node(self, index):
+        return NODE_CLASS[self.kind[index]](self, index)
+
+    def subtree_end(self, index):
+        # the last child of a node is laid out last, so follow the last children
+        kind = self.kind
+        child = self.child
+        while kind[index] in (ADD, LET):
+            index = child[index]
+        return index + 1
+
+    def from_list(self, exp):
+        # work items are (parent, exp), parent is the node whose child
+        # index exp fills in, -1 for a root or a first child
+        root = len(self.kind)
+        work_lst = [(-1, exp)]
+        while work_lst:
+            parent, exp = work_lst.pop()
+            if parent >= 0:
+                self.child[parent] = len(self.kind)
+            match exp:
+                case ["int", i]:
+                    self.new_node(INT, to_int64(i))
+                case ["var", var]:
+                    self.new_node(VAR, self.name_id(var))
+                case ["read"]:
+                    self.new_node(READ)
+                case ["+", arg1, arg2]:
+                    index = self.new_node(ADD)
+                    work_lst.append((index, arg2))
+                    work_lst.append((-1, arg1))
+                case ["let", [var, value], let_exp]:
+                    index = self.new_node(LET, self.name_id(var))
+                    work_lst.append((index, let_exp))
+                    work_lst.append((-1, value))
+                case _:
+                    raise SyntaxError("Arena Err: Unknown Exp {}".format(exp))
+        return root
+
+    def to_list(self, root):
+        # children always come after their parent, so build from the back
+        kind = self.kind
+        arg = self.arg
+        child = self.child
+        names = self.names
+        end = self.subtree_end(root)
+        built = [None] * (end - root)
+        for index in range(end - 1, root - 1, -1):
+            node_kind = kind[index]
+            if node_kind == INT:
+                exp = ["int", arg[index]]
+            elif node_kind == VAR:
+                exp = ["var", names[arg[index]]]
+            elif node_kind == READ:
+                exp = ["read"]
+            elif node_kind == ADD:
+                exp = ["+", built[index + 1 - root], built[child[index] - root]]
+            else:
+                exp = ["let", [names[arg[index]], built[index + 1 - root]], built[child[index] - root]]
+            built[index - root] = exp
+        return built[0]
+
+class Node:
+    __slots__ = ("arena", "index")
+
+    def __init__(self, arena, index):
+        self.arena = arena
+        self.index = index
+
+    def __eq__(self, other):
+        return isinstance(other, Node) and self.arena is other.arena and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.arena), self.index))
+
+class Int(Node):
+    __slots__ = ()
+    __match_args__ = ("value",)
+
+    @property
+    def value(self):
+        return self.arena.arg[self.index]
+
+class Var(Node):
+    __slots__ = ()
+    __match_args__ = ("name",)
+
+    @property
+    def name(self):
+        return self.arena.names[self.arena.arg[self.index]]
+
+class Read(Node):
+    __slots__ = ()
+
+class Add(Node):
+    __slots__ = ()
+    __match_args__ = ("arg1", "arg2")
+
+    @property
+    def arg1(self):
+        return self.arena.node(self.index + 1)
+
+    @property
+    def arg2(self):
+        return self.arena.node(self.arena.child[self.index])
+
+class Let(Node):
+    __slots__ = ()
+    __match_args__ = ("var", "value", "body")
+
+    @property
+    def var(self):
+        return self.arena.names[self.arena.arg[self.index]]
+
+    @property
+    def value(self):
+        return self.arena.node(self.index + 1)
+
+    @property
+    def body(self):
+        return self.arena.node(self.arena.child[self.index])
+
+NODE_CLASS = (Int, Var, Read, Add, Let)
@@ -0,0 +1,968 @@
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import contextlib
+import subprocess
+from reader import open_source, scan, parse
+from let_lan import BasicBlock, StackFrame, uniquify, flatten, uniquify_flatten, select_instruction, assign_home, patch_instruction, \
+    is_imm32, print_x84_64
+from opt import to_int64, bind_reads, const_eval, partial_eval, uniquify_partial_eval, reassociate, copy_propagate, value_number, dead_code_eliminate
+from arena import Arena, INT
+from symbols import Symbols, ScopedEnv
+from hashcons import HashCons
+from printer import write_exp
+import fl
+from ssa import to_ssa, live_ranges
+from superopt import apply_rules
+from reg_alloc import REG_LST, CALLER_SAVED_REG_LST, CALLEE_SAVED_REG_LST, uncover_live, color_graph, linear_scan
+
+def gen_balanced_add(leaf_num):
+    # (+ (+ 1 2) (+ 3 4)) ... shaped, depth stays log2(leaf_num)
+    level = [str(i % 100) for i in range(leaf_num)]
+    while len(level) > 1:
+        next_level = []
+        for i in range(0, len(level) - 1, 2):
+            next_level.append("(+ " + level[i] + " " + level[i + 1] + ")")
+        if len(level) % 2 == 1:
+            next_level.append(level[-1])
+        level = next_level
+    return level[0]
+
+def pop_parse(tokens):
+    # the old tokens.pop(0) parser, kept here as the baseline
+    token = tokens.pop(0)
+    if token == '(':
+        exp_lst = [tokens.pop(0)]
+        while tokens[0] != ')':
+            exp_lst.append(pop_parse(tokens))
+        tokens.pop(0)
+        return exp_lst
+    elif token[0].isdigit() or token[0] == "-":
+        return ["int", int(token)]
+    else:
+        return ["var", token]
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+def bench_parse():
+    print("[parse] tokens, cursor parse, ns/token, pop(0) parse")
+    for leaf_num in (250, 2500, 25000, 250000):
+        tokens = list(scan(gen_balanced_add(leaf_num)))
+        cursor_time = timeit(parse, tokens)
+        pop_time = "-"
+        if len(tokens) <= 100000:
+            pop_time = "{:.3f}s".format(timeit(pop_parse, [token for token, _ in tokens]))
+        print("{:>9} {:>9.3f}s {:>9.1f} {:>10}".format(
+            len(tokens), cursor_time, cursor_time * 1e9 / len(tokens), pop_time))
+
+def split_scan(code):
+    # the old str.replace/split scanner, kept here as the baseline
+    return code.replace("(", " ( ").replace(")", " ) ").split()
+
+def peak_memory(func, *args):
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def count_tokens(tokens):
+    num = 0
+    for _ in tokens:
+        num += 1
+    return num
+
+def bench_scan():
+    print("[scan] source bytes, peak heap of read+split, peak heap of mmap+scan")
+    for leaf_num in (2500, 25000, 250000):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as f:
+            f.write(gen_balanced_add(leaf_num))
+        def read_split():
+            with open(path) as f:
+                split_scan(f.read())
+        def mmap_scan():
+            count_tokens(scan(open_source(path)))
+        print("{:>9} {:>12} {:>12}".format(os.path.getsize(path), peak_memory(read_split), peak_memory(mmap_scan)))
+        os.remove(path)
+
+def gen_deep_multi_let(repeat):
+    # test/multi_let's let chain nested repeat times, 5 lets per repeat
+    let_chain = "(let (v 1) (let (w 42) (let (x (+ v 7)) (let (y x) (let (z (+ x w)) "
+    return let_chain * repeat + "(+ z y)" + ")" * (5 * repeat)
+
+def gen_deep_add(depth):
+    return "(+ 1 " * depth + "2" + ")" * depth
+
+def rec_uniquify(exp, env):
+    # the old recursive uniquify, kept here as the baseline
+    match exp:
+        case ["var", var]:
+            return ["var", env.find(var)]
+        case ["+", arg1, arg2]:
+            return ["+", rec_uniquify(arg1, env), rec_uniquify(arg2, env)]
+        case ["let", [var, value], let_exp]:
+            new_value = rec_uniquify(value, env)
+            new_var = Symbols.get_new_symbol(var)
+            env.bind(var, new_var)
+            new_let_exp = rec_uniquify(let_exp, env)
+            env.unbind()
+            return ["let", [new_var, new_value], new_let_exp]
+        case _:
+            return exp
+
+def rec_flatten(exp, dest, bb):
+    # the old recursive flatten, kept here as the baseline
+    match exp:
+        case ["read"]:
+            bb.append(["assign", dest, ["func", "read_int"]])
+        case [("var" | "int"), _]:
+            bb.append(["assign", dest, exp])
+        case ["+", arg1, arg2]:
+            if arg1[0] not in ("int", "var"):
+                tmp_var = ["var", Symbols.get_new_symbol("tmp")]
+                rec_flatten(arg1, tmp_var, bb)
+                arg1 = tmp_var
+            if arg2[0] not in ("int", "var"):
+                tmp_var = ["var", Symbols.get_new_symbol("tmp")]
+                rec_flatten(arg2, tmp_var, bb)
+                arg2 = tmp_var
+            bb.append(["assign", dest, ["+", arg1, arg2]])
+        case ["let", [var, value], let_exp]:
+            rec_flatten(value, ["var", var], bb)
+            rec_flatten(let_exp, dest, bb)
+
+def check_deep(code):
+    # the work stack passes must give what the recursive ones give
+    Symbols.reset()
+    bb = BasicBlock("start", "conclusion")
+    flatten(uniquify(parse(scan(code)), ScopedEnv()), ["reg", "rax"], bb)
+    Symbols.reset()
+    rec_bb = BasicBlock("start", "conclusion")
+    rec_ast = pop_parse([token for token, _ in scan(code)])
+    rec_flatten(rec_uniquify(rec_ast, ScopedEnv()), ["reg", "rax"], rec_bb)
+    assert bb.inst_lst == rec_bb.inst_lst, "deep: work stack passes differ from the recursive ones"
+
+def bench_deep():
+    check_deep(gen_deep_multi_let(100))
+    check_deep(gen_deep_add(500))
+    print("[deep] nesting, parse, uniquify, flatten, instructions")
+    for name, code, depth in (("let", gen_deep_multi_let(200000), 1000000),
+                              ("+", gen_deep_add(1000000), 1000000)):
+        start = time.perf_counter()
+        ast = parse(scan(code))
+        parse_time = time.perf_counter() - start
+        start = time.perf_counter()
+        u_ast = uniquify(ast, ScopedEnv())
+        uniquify_time = time.perf_counter() - start
+        bb = BasicBlock("start", "conclusion")
+        start = time.perf_counter()
+        flatten(u_ast, ["reg", "rax"], bb)
+        flatten_time = time.perf_counter() - start
+        print("{:>3} {:>8} {:>8.3f}s {:>8.3f}s {:>8.3f}s {:>8}".format(
+            name, depth, parse_time, uniquify_time, flatten_time, len(bb.inst_lst)))
+
+def list_int_sum(exp):
+    total = 0
+    work_lst = [exp]
+    while work_lst:
+        exp = work_lst.pop()
+        match exp:
+            case ["int", i]:
+                total += i
+            case ["+", arg1, arg2]:
+                work_lst.append(arg2)
+                work_lst.append(arg1)
+            case ["let", [_, value], let_exp]:
+                work_lst.append(let_exp)
+                work_lst.append(value)
+    return total
+
+def arena_int_sum(arena):
+    arg = arena.arg
+    total = 0
+    for index, kind in enumerate(arena.kind):
+        if kind == INT:
+            total += arg[index]
+    return total
+
+def exp_text(exp):
+    out = io.StringIO()
+    write_exp(exp, out)
+    return out.getvalue()
+
+def bench_arena():
+    print("[arena] program, nodes, list bytes/node, arena bytes/node, list sum, arena sum")
+    for name, code in (("balanced +", gen_balanced_add(250000)),
+                       ("multi_let", gen_deep_multi_let(20000))):
+        tracemalloc.start()
+        ast = parse(scan(code))
+        list_size = tracemalloc.get_traced_memory()[0]
+        arena = Arena()
+        root = arena.from_list(ast)
+        arena_size = tracemalloc.get_traced_memory()[0] - list_size
+        tracemalloc.stop()
+        node_num = len(arena)
+        list_time = timeit(list_int_sum, ast)
+        arena_time = timeit(arena_int_sum, arena)
+        assert list_int_sum(ast) == arena_int_sum(arena)
+        # == on lists recurses, so the round trip is compared printed
+        assert exp_text(arena.to_list(root)) == exp_text(ast), "arena: {} does not come back from to_list".format(name)
+        print("{:>10} {:>8} {:>8.1f} {:>8.1f} {:>8.3f}s {:>8.3f}s".format(
+            name, node_num, list_size / node_num, arena_size / node_num, list_time, arena_time))
+
+def gen_var_chain(var_num):
+    # (let (v0 1) (let (v1 (+ v0 1)) ... v<var_num-1>)), one new variable per let
+    lets = ["(let (v0 1) "]
+    for i in range(1, var_num):
+        lets.append("(let (v{} (+ v{} 1)) ".format(i, i - 1))
+    return "".join(lets) + "v{}".format(var_num - 1) + ")" * var_num
+
+def compile_to_home(ast):
+    bb = BasicBlock("start", "conclusion")
+    flatten(uniquify(ast, ScopedEnv()), ["reg", "rax"], bb)
+    select_instruction(bb)
+    assign_home(bb, StackFrame())
+    return bb
+
+def bench_symbols():
+    print("[symbols] variables, uniquify..assign_home time, peak heap")
+    for var_num in (1000, 10000, 100000):
+        ast = parse(scan(gen_var_chain(var_num)))
+        start = time.perf_counter()
+        compile_to_home(ast)
+        run_time = time.perf_counter() - start
+        print("{:>8} {:>8.3f}s {:>12}".format(var_num, run_time, peak_memory(compile_to_home, ast)))
+
+def gen_outer_ref_chain(var_num):
+    # every let value refers to the outermost binding, var_num scopes away at the end
+    lets = ["(let (a 1) "]
+    for i in range(var_num):
+        lets.append("(let (v{} (+ a 1)) ".format(i))
+    return "".join(lets) + "a" + ")" * (var_num + 1)
+
+def bench_scope():
+    print("[scope] nesting, uniquify time, ns/let")
+    for var_num in (1000, 10000, 100000):
+        ast = parse(scan(gen_outer_ref_chain(var_num)))
+        run_time = timeit(uniquify, ast, ScopedEnv())
+        print("{:>8} {:>8.3f}s {:>8.1f}".format(var_num, run_time, run_time * 1e9 / var_num))
+
+def two_pass_front(ast):
+    # like the driver, the renamed AST stays alive while flatten runs
+    Symbols.reset()
+    bb = BasicBlock("start", "conclusion")
+    u_ast = uniquify(ast, ScopedEnv())
+    flatten(u_ast, ["reg", "rax"], bb)
+    return bb
+
+def fused_front(ast):
+    Symbols.reset()
+    bb = BasicBlock("start", "conclusion")
+    uniquify_flatten(ast, ScopedEnv(), ["reg", "rax"], bb)
+    return bb
+
+def block_text(bb):
+    out = io.StringIO()
+    bb.write(out)
+    return out.getvalue()
+
+def check_fused():
+    # --fused must give the two-pass block. At -O0 the fused walk takes tmps
+    # between let symbols, so only the names match, at -O1 the ids do too
+    for name, code in list(test_corpus()) + synthetic_programs() + \
+            [("random {}".format(seed), gen_random_add(256, seed)) for seed in range(3)]:
+        ast = parse(scan(code))
+        for opt_level in (0, 1):
+            # names are looked up before the next run resets the Symbols
+            two_pass_bb = optimize_block(ast, opt_level)
+            two_pass_text = block_text(two_pass_bb)
+            fused_bb = optimize_block(ast, opt_level, True)
+            assert two_pass_text == block_text(fused_bb), \
+                "fused: {} at -O{} differs from the two passes".format(name, opt_level)
+            assert opt_level == 0 or two_pass_bb.inst_lst == fused_bb.inst_lst, \
+                "fused: {} at -O1 takes other symbol ids".format(name)
+
+def bench_fused():
+    check_fused()
+    print("[fused] program, two-pass time, fused time, two-pass peak heap, fused peak heap")
+    for name, code in (("balanced +", gen_balanced_add(250000)),
+                       ("multi_let", gen_deep_multi_let(40000)),
+                       ("var chain", gen_var_chain(100000))):
+        ast = parse(scan(code))
+        print("{:>10} {:>8.3f}s {:>8.3f}s {:>12} {:>12}".format(
+            name, timeit(two_pass_front, ast), timeit(fused_front, ast),
+            peak_memory(two_pass_front, ast), peak_memory(fused_front, ast)))
+
+def gen_repetitive(leaf_num):
+    # a balanced sum of the same few subexpressions under one (read) binding
+    pieces = ["(+ x 3)", "(let (y (+ x 1)) (+ y 2))", "(+ (+ x 3) (+ 1 2))"]
+    level = [pieces[i % len(pieces)] for i in range(leaf_num)]
+    while len(level) > 1:
+        next_level = []
+        for i in range(0, len(level) - 1, 2):
+            next_level.append("(+ " + level[i] + " " + level[i + 1] + ")")
+        if len(level) % 2 == 1:
+            next_level.append(level[-1])
+        level = next_level
+    return "(let (x (read)) " + level[0] + ")"
+
+def live_memory(func, *args):
+    tracemalloc.start()
+    result = func(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+def parse_uniquify(code, table):
+    Symbols.reset()
+    ast = parse(scan(code), table)
+    return ast, uniquify(ast, ScopedEnv(), table)
+
+def bench_hash_cons():
+    print("[hash-cons] leaves, AST+renamed AST heap, hash-consed heap, shared nodes")
+    for leaf_num in (1000, 10000, 100000):
+        code = gen_repetitive(leaf_num)
+        table = HashCons()
+        plain_size = live_memory(parse_uniquify, code, None)
+        shared_size = live_memory(parse_uniquify, code, table)
+        print("{:>8} {:>12} {:>12} {:>8}".format(leaf_num, plain_size, shared_size, len(table)))
+
+def bench_printer():
+    print("[printer] let nesting, AST write time, ns/node, block insts, block write time")
+    for repeat in (2000, 20000, 200000):
+        ast = parse(scan(gen_deep_multi_let(repeat)))
+        bb = two_pass_front(ast)
+        out = io.StringIO()
+        exp_time = timeit(write_exp, ast, out)
+        arena = Arena()
+        arena.from_list(ast)
+        node_num = len(arena)
+        block_time = timeit(bb.write, io.StringIO())
+        print("{:>8} {:>8.3f}s {:>8.1f} {:>8} {:>8.3f}s".format(
+            repeat * 5, exp_time, exp_time * 1e9 / node_num, len(bb.inst_lst), block_time))
+
+def optimize_block(ast, opt_level, fused=False, skip=(), width=1):
+    # the let_lan.py pipeline up to the optimized IR, --fused runs the
+    # fused front end and skip leaves out the named optimization passes
+    Symbols.reset()
+    bb = BasicBlock("start", "conclusion")
+    if fused and opt_level >= 1:
+        flatten(uniquify_partial_eval(ast, ScopedEnv()), ["reg", "rax"], bb, True)
+    elif fused:
+        uniquify_flatten(ast, ScopedEnv(), ["reg", "rax"], bb)
+    else:
+        u_ast = uniquify(ast, ScopedEnv())
+        if opt_level >= 1:
+            if "partial_eval" not in skip:
+                u_ast = partial_eval(u_ast)
+        flatten(u_ast, ["reg", "rax"], bb, opt_level >= 1)
+    if opt_level >= 1:
+        if "copy_propagate" not in skip:
+            copy_propagate(bb)
+        if "reassociate" not in skip:
+            reassociate(bb, width)
+        if "value_number" not in skip:
+            value_number(bb)
+        if "dead_code_eliminate" not in skip:
+            dead_code_eliminate(bb)
+    return bb
+
+def compile_block(ast, opt_level, fused=False, skip=()):
+    bb = optimize_block(ast, opt_level, fused, skip)
+    select_instruction(bb)
+    assign_home(bb, StackFrame())
+    patch_instruction(bb)
+    if opt_level >= 1 and "superopt" not in skip:
+        apply_rules(bb)
+    return bb
+
+def test_corpus():
+    test_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test")
+    for name in sorted(os.listdir(test_dir)):
+        with open(os.path.join(test_dir, name)) as f:
+            yield name, f.read()
+
+def gen_half_read(leaf_num):
+    # balanced sum where every other leaf is a (read) and the rest are let-bound constants
+    leaves = ["(read)" if i % 2 else "(let (c {}) (+ c 1))".format(i) for i in range(leaf_num)]
+    while len(leaves) > 1:
+        leaves = ["(+ " + leaves[i] + " " + leaves[i + 1] + ")" for i in range(0, len(leaves) - 1, 2)] + \
+                 ([leaves[-1]] if len(leaves) % 2 else [])
+    return leaves[0]
+
+def instruction_counts(bench_name, programs, *options):
+    # options are (opt_level, fused, skipped passes) triples
+    print("[{}] program, instructions at {}".format(bench_name, ", ".join(
+        "-O{}{}{}".format(opt_level, " --fused" if fused else "", "".join(" -" + name for name in skip))
+        for opt_level, fused, skip in options)))
+    for name, code in programs:
+        ast = parse(scan(code))
+        counts = [len(compile_block(ast, opt_level, fused, skip).inst_lst) for opt_level, fused, skip in options]
+        print("{:>14} ".format(name) + " ".join("{:>8}".format(count) for count in counts))
+
+def synthetic_programs():
+    return [("balanced +", gen_balanced_add(1000)),
+            ("var chain", gen_var_chain(1000)),
+            ("multi_let", gen_deep_multi_let(200)),
+            ("half read", gen_half_read(1000)),
+            ("repetitive", gen_repetitive(1000))]
+
+def bench_fold():
+    instruction_counts("fold", list(test_corpus()) + synthetic_programs(), (0, False, ()), (1, False, ()))
+
+def bench_copy_prop():
+    # -O1 without partial_eval shows the block passes alone
+    instruction_counts("copy-prop", list(test_corpus()) + synthetic_programs(),
+                       (0, False, ()), (1, False, ("partial_eval",)), (1, False, ()))
+
+def gen_common_sums(sum_num):
+    # the same few sums of two reads, in both operand orders, bound to new names
+    lets = ["(let (a (read)) (let (b (read)) "]
+    for i in range(sum_num):
+        lets.append("(let (s{} (+ {})) ".format(i, ("a b", "b a", "a 5", "5 a")[i % 4]))
+    total = "0"
+    for i in range(sum_num):
+        total = "(+ s{} {})".format(i, total)
+    return "".join(lets) + total + ")" * (sum_num + 2)
+
+def bench_cse():
+    programs = list(test_corpus()) + synthetic_programs() + [("common sums", gen_common_sums(1000))]
+    # reassociate left out of both, it folds most of these sums away by itself
+    instruction_counts("cse", programs, (1, False, ("reassociate", "value_number")), (1, False, ("reassociate",)))
+
+def gen_mixed_sums(sum_num):
+    # right nested sums of three read vars and small ints, (+ a (+ 2 (+ b ...)))
+    lets = "(let (a (read)) (let (b (read)) (let (c (read)) "
+    total = "0"
+    for i in range(sum_num):
+        total = "(+ {} (+ {} {}))".format("abc"[i % 3], i % 7, total)
+    return lets + total + ")))"
+
+def gen_left_read_sum(read_num):
+    # (+ (+ (+ (read) (read)) (read)) ...), a read between every two sums
+    return "(+ " * (read_num - 1) + "(read)" + " (read))" * (read_num - 1)
+
+def color_block(ast, skip):
+    # the let_lan_with_reg_alloc.py homes at -O1, memory operands and
+    # callee saved pushes, which is where a sum kept live over a call shows
+    bb = optimize_block(ast, 1, False, skip)
+    select_instruction(bb)
+    reg_sf = color_graph(uncover_live(bb.inst_lst))
+    assign_home(bb, reg_sf)
+    patch_instruction(bb, "r11")
+    return memory_operands(bb), len(reg_sf.saved_reg_lst)
+
+def bench_reassoc():
+    programs = list(test_corpus()) + synthetic_programs() + \
+        [("mixed sums", gen_mixed_sums(1000)), ("left reads", gen_left_read_sum(201))]
+    print("[reassoc] program, IR assigns and instructions at -O1 without and with reassociate, "
+          "memory operands and pushes with coloring without and with reassociate")
+    for name, code in programs:
+        ast = parse(scan(code))
+        sizes = []
+        for skip in (("reassociate",), ()):
+            sizes.append(len(optimize_block(ast, 1, False, skip).inst_lst))
+            sizes.append(len(compile_block(ast, 1, False, skip).inst_lst))
+            sizes += color_block(ast, skip)
+        print("{:>14} {:>8} -> {:<8} {:>8} -> {:<8} {:>6} -> {:<6} {:>3} -> {}".format(
+            name, sizes[0], sizes[4], sizes[1], sizes[5], sizes[2], sizes[6], sizes[3], sizes[7]))
+
+def compile_asm(ast, width):
+    bb = optimize_block(ast, 1, width=width)
+    select_instruction(bb)
+    sf = StackFrame()
+    assign_home(bb, sf)
+    patch_instruction(bb)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        print_x84_64(bb, sf)
+    return out.getvalue()
+
+# calls the compiled _main in a loop, its (read) calls count up from 1
+ILP_HARNESS = r"""
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+static long read_num;
+long lan_main(void) __asm__("_lan_main");
+long lan_read_int(void) __asm__("_read_int");
+long lan_read_int(void) { return ++read_num; }
+int main(int argc, char **argv) {
+    long call_num = atol(argv[1]), total = 0;
+    struct timespec start, end;
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    for (long i = 0; i < call_num; i++) {
+        read_num = 0;
+        total += lan_main();
+    }
+    clock_gettime(CLOCK_MONOTONIC, &end);
+    double ns = (end.tv_sec - start.tv_sec) * 1e9 + (end.tv_nsec - start.tv_nsec);
+    printf("%.1f %ld\n", ns / call_num, total);
+    return 0;
+}
+"""
+
+def gen_read_sum(read_num):
+    # (+ (read) (+ (read) ... 0)), nothing for the optimizer to merge
+    return "(+ (read) " * read_num + "0" + ")" * read_num
+
+def bench_ilp():
+    # runs the compiled binaries, the sum as one chain and as 2, 4 and 7
+    # partial sums, best of 3. Needs a gcc on the path
+    call_num = 200000
+    print("[ilp] reads, ns per run of _main at --balance 1, 2, 4, 7")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        harness_path = os.path.join(tmp_dir, "harness.c")
+        with open(harness_path, "w") as f:
+            f.write(ILP_HARNESS)
+        for read_num in (16, 64, 256):
+            ast = parse(scan(gen_read_sum(read_num)))
+            ns_lst = []
+            for width in (1, 2, 4, 7):
+                asm_path = os.path.join(tmp_dir, "sum{}.s".format(width))
+                exe_path = os.path.join(tmp_dir, "sum{}".format(width))
+                with open(asm_path, "w") as f:
+                    f.write(compile_asm(ast, width).replace("_main", "_lan_main"))
+                subprocess.run(["gcc", "-O2", "-o", exe_path, harness_path, asm_path], capture_output=True, check=True)
+                best_ns = None
+                for _ in range(3):
+                    result = subprocess.run([exe_path, str(call_num)], capture_output=True, text=True, check=True)
+                    ns, total = result.stdout.split()
+                    assert int(total) == call_num * (read_num * (read_num + 1) // 2)
+                    best_ns = float(ns) if best_ns is None else min(best_ns, float(ns))
+                ns_lst.append(best_ns)
+            print("{:>8} {}".format(read_num, " ".join("{:>8.1f}".format(ns) for ns in ns_lst)))
+
+def gen_right_heavy(depth):
+    # (+ (+ x 1) (+ (+ x 2) ...)), every right side deeper than its left
+    return "(let (x 1) " + "".join("(+ (+ x {}) ".format(i) for i in range(depth)) + "x" + ")" * depth + ")"
+
+def gen_random_add(leaf_num, seed):
+    # + trees of random shape over x and small ints
+    rng = random.Random(seed)
+    level = ["x" if rng.random() < 0.5 else str(rng.randrange(100)) for _ in range(leaf_num)]
+    while len(level) > 1:
+        i = rng.randrange(len(level) - 1)
+        level[i:i + 2] = ["(+ " + level[i] + " " + level[i + 1] + ")"]
+    return "(let (x 1) " + level[0] + ")"
+
+def max_live(bb):
+    # most vars live at once in a flattened block
+    live_set = set()
+    most = 0
+    for inst in reversed(bb.inst_lst):
+        match inst:
+            case ["assign", dest, src]:
+                if dest[0] == "var":
+                    live_set.discard(dest[1])
+                for arg in (src[1:] if src[0] == "+" else [src]):
+                    if arg[0] == "var":
+                        live_set.add(arg[1])
+        most = max(most, len(live_set))
+    return most
+
+def fl_frame_len(u_ast, reorder):
+    # slots fl.py's StackFrame hands out, the first two are rcx and rdx
+    bb = fl.BasicBlock("start")
+    swap_set = set()
+    if reorder:
+        fl.su_need(u_ast, swap_set)
+    fl.flatten(u_ast, ["reg", "rax"], bb, swap_set)
+    fl.select_instruction(bb)
+    sf = fl.StackFrame()
+    fl.assign_home(bb.inst_lst, fl.cal_liveness(bb.inst_lst), sf)
+    return sf.frame_len
+
+def bench_su():
+    programs = [("right heavy", gen_right_heavy(200)), ("balanced +", gen_balanced_add(256))] + \
+        [("random {}".format(seed), gen_random_add(256, seed)) for seed in range(3)]
+    print("[su] program, most live vars in flatten, fl.py frame slots, in source order and Sethi-Ullman order")
+    for name, code in programs:
+        ast = parse(scan(code))
+        sizes = []
+        for reorder in (False, True):
+            Symbols.reset()
+            bb = BasicBlock("start", "conclusion")
+            flatten(uniquify(ast, ScopedEnv()), ["reg", "rax"], bb, reorder)
+            sizes.append(max_live(bb))
+            Symbols.reset()
+            sizes.append(fl_frame_len(fl.uniquify(ast, ScopedEnv()), reorder))
+        print("{:>14} {:>6} -> {:<6} {:>6} -> {}".format(name, sizes[0], sizes[2], sizes[1], sizes[3]))
+
+def bench_const():
+    # read free programs: the -O1 pipeline against const_eval alone
+    programs = [(name, code) for name, code in list(test_corpus()) + synthetic_programs() if "read" not in code]
+    print("[const] program, -O1 pipeline ms, const_eval ms")
+    for name, code in programs:
+        ast = parse(scan(code))
+        print("{:>14} {:>9.3f} {:>9.3f}".format(name, timeit(compile_block, ast, 1) * 1e3, timeit(const_eval, ast) * 1e3))
+
+def count_reads(exp):
+    read_num = 0
+    work_lst = [exp]
+    while work_lst:
+        match work_lst.pop():
+            case ["read"]:
+                read_num += 1
+            case ["+", arg1, arg2] | ["let", [_, arg1], arg2]:
+                work_lst.append(arg1)
+                work_lst.append(arg2)
+    return read_num
+
+def bench_bind():
+    # instructions at -O1 as compiled and with every (read) bound, a bound
+    # program is left read free and becomes the two instruction const main
+    programs = [(name, code) for name, code in list(test_corpus()) + synthetic_programs() if "read" in code]
+    programs += [("read sum", gen_read_sum(256)), ("mixed sums", gen_mixed_sums(1000))]
+    print("[bind] program, reads, instructions at -O1, with --bind-reads")
+    for name, code in programs:
+        ast = parse(scan(code))
+        read_num = count_reads(ast)
+        bound_ast = bind_reads(ast, list(range(1, read_num + 1)))
+        bound_num = 2 if const_eval(bound_ast) is not None else len(compile_block(bound_ast, 1).inst_lst)
+        print("{:>14} {:>6} {:>8} {:>8}".format(name, read_num, len(compile_block(ast, 1).inst_lst), bound_num))
+
+def flat_block(ast):
+    Symbols.reset()
+    bb = BasicBlock("start", "conclusion")
+    flatten(uniquify(ast, ScopedEnv()), ["reg", "rax"], bb)
+    return bb
+
+def bench_ssa():
+    # liveness of right heavy sums kept in source order, so every tmp stays
+    # live to the end: fl.py's live set per instruction against SSA live ranges
+    print("[ssa] instructions, fl.py cal_liveness, to_ssa + live_ranges")
+    for depth in (500, 1000, 2000, 4000):
+        bb = flat_block(parse(scan(gen_right_heavy(depth))))
+        ssa_time = timeit(lambda: live_ranges(to_ssa(bb)))
+        fl.select_instruction(bb)
+        print("{:>8} {:>9.3f}s {:>9.3f}s".format(len(bb.inst_lst), timeit(fl.cal_liveness, bb.inst_lst), ssa_time))
+
+def bench_superopt():
+    programs = list(test_corpus()) + synthetic_programs() + \
+        [("read sum", gen_read_sum(256)), ("right heavy", gen_right_heavy(200))]
+    instruction_counts("superopt", programs, (1, False, ("superopt",)), (1, False, ()))
+
+def memory_operands(bb):
+    return sum(1 for inst in bb.inst_lst if any(arg[0] == "deref" for arg in inst[1:]))
+
+def gen_random_program(depth, rng, var_lst=()):
+    # random lets, sums, reads, vars and ints, some past 32 bits
+    choice = rng.random()
+    if depth == 0 or choice < 0.2:
+        choice = rng.random()
+        if var_lst and choice < 0.4:
+            return rng.choice(var_lst)
+        if choice < 0.7:
+            return "(read)"
+        return str(rng.choice((rng.randrange(-5, 50), rng.randrange(-(1 << 40), 1 << 40))))
+    if choice < 0.6:
+        return "(+ {} {})".format(gen_random_program(depth - 1, rng, var_lst), gen_random_program(depth - 1, rng, var_lst))
+    var = rng.choice("abcxyz")
+    return "(let ({} {}) {})".format(var, gen_random_program(depth - 1, rng, var_lst),
+                                     gen_random_program(depth - 1, rng, tuple(var_lst) + (var,)))
+
+def run_homed(bb, sf, value_lst):
+    # runs a homed and patched block the way let_lan_with_reg_alloc.py's
+    # _main would, with a read_int that hands out value_lst and leaves
+    # garbage in every caller saved register. Checks operands are ones
+    # x86-64 takes, slots are inside the frame, rsp is 16 byte aligned at
+    # each callq and the callee saved registers come back. Returns rax
+    push_num = len(sf.saved_reg_lst)
+    frame_size = sf.get_frame_size()
+    reg_dict = {reg: -(i + 1) << 32 for i, reg in enumerate(CALLEE_SAVED_REG_LST)}
+    saved_dict = dict(reg_dict)
+    mem_dict = {-8 * (i + 1): reg_dict[reg] for i, reg in enumerate(sf.saved_reg_lst)}
+
+    def read(operand):
+        match operand:
+            case ["int", i]:
+                return i
+            case ["reg", reg]:
+                value = reg_dict.get(reg)
+            case ["deref", "rbp", offset]:
+                value = mem_dict.get(offset)
+            case ["lea", base, index, disp]:
+                return to_int64(read(["reg", base]) + (0 if index is None else read(["reg", index])) + (disp or 0))
+        assert value is not None, "run: {} read before it is set".format(operand)
+        return value
+
+    def write(operand, value):
+        match operand:
+            case ["reg", reg]:
+                reg_dict[reg] = value
+            case ["deref", "rbp", offset]:
+                assert -8 * push_num - frame_size <= offset < 0, "run: slot {} outside the frame".format(offset)
+                mem_dict[offset] = value
+
+    read_num = 0
+    for inst in bb.inst_lst:
+        match inst:
+            case ["callq", ["func", "read_int"]]:
+                assert (8 * push_num + frame_size) % 16 == 0, "run: rsp not aligned at callq"
+                for reg in CALLER_SAVED_REG_LST + ["rax", "r11"]:
+                    reg_dict[reg] = None
+                reg_dict["rax"] = value_lst[read_num]
+                read_num += 1
+            case [op, src, dest]:
+                assert src[0] != "deref" or dest[0] != "deref", "run: two memory operands in {}".format(inst)
+                assert src[0] != "int" or is_imm32(src[1]) or (op == "movq" and dest[0] == "reg"), \
+                    "run: 64 bit immediate in {}".format(inst)
+                match op:
+                    case "movq" | "leaq":
+                        write(dest, read(src))
+                    case "addq":
+                        write(dest, to_int64(read(dest) + read(src)))
+    for i, reg in enumerate(sf.saved_reg_lst):
+        reg_dict[reg] = mem_dict[-8 * (i + 1)]
+    assert all(reg_dict[reg] == saved_dict[reg] for reg in CALLEE_SAVED_REG_LST), "run: callee saved register lost"
+    return read(["reg", "rax"])
+
+def check_regalloc(program_num=150, seed=0):
+    # the allocated code must give what the program evaluates to, at -O0
+    # and -O1, with coloring, coloring without coalescing and linear scan,
+    # over all the registers, two caller saved ones and three callee saved
+    rng = random.Random(seed)
+    for _ in range(program_num):
+        code = gen_random_program(rng.randrange(2, 9), rng)
+        ast = parse(scan(code))
+        value_lst = [rng.randrange(-(1 << 40), 1 << 40) for _ in range(count_reads(ast))]
+        expected = const_eval(bind_reads(ast, value_lst))
+        for opt_level in (0, 1):
+            for alloc in ("color", "no-coalesce", "linear"):
+                for reg_lst in (REG_LST, CALLER_SAVED_REG_LST[:2], CALLEE_SAVED_REG_LST[:3]):
+                    bb = optimize_block(ast, opt_level, width=rng.choice((1, 3)))
+                    select_instruction(bb)
+                    if alloc == "linear":
+                        sf = linear_scan(bb.inst_lst, reg_lst)
+                    else:
+                        sf = color_graph(uncover_live(bb.inst_lst), reg_lst, alloc == "color")
+                    assign_home(bb, sf)
+                    patch_instruction(bb, "r11")
+                    if opt_level >= 1:
+                        apply_rules(bb)
+                    assert run_homed(bb, sf, value_lst) == expected, \
+                        "regalloc: {} at -O{} with {} over {} gives the wrong value".format(code, opt_level, alloc, reg_lst)
+
+def bench_regalloc():
+    check_regalloc()
+    # spilled vars and instructions touching memory, with let_lan.py's
+    # StackFrame, fl.py's two register StackFrame and graph coloring. fl.py
+    # has no (read) and recurses, so it is left out for reads and deep nesting
+    programs = list(test_corpus()) + synthetic_programs() + \
+        [("read sum", gen_read_sum(256)), ("right heavy", gen_right_heavy(200))]
+    for opt_level in (0, 1):
+        print("[regalloc] program, spilled vars with StackFrame, fl.py and coloring at -O{}, "
+              "memory operands with StackFrame and coloring".format(opt_level))
+        for name, code in programs:
+            ast = parse(scan(code))
+            bb = optimize_block(ast, opt_level)
+            select_instruction(bb)
+            sf = StackFrame()
+            assign_home(bb, sf)
+            patch_instruction(bb)
+            stack_memory = memory_operands(bb)
+            fl_spill = "-"
+            if count_reads(ast) == 0:
+                Symbols.reset()
+                try:
+                    fl_spill = max(0, fl_frame_len(fl.uniquify(ast, ScopedEnv()), opt_level >= 1) - 2)
+                except RecursionError:
+                    pass
+            bb = optimize_block(ast, opt_level)
+            select_instruction(bb)
+            start = time.perf_counter()
+            reg_sf = color_graph(uncover_live(bb.inst_lst))
+            alloc_ms = (time.perf_counter() - start) * 1000
+            assign_home(bb, reg_sf)
+            patch_instruction(bb, "r11")
+            print("{:>14} {:>6} {:>6} {:>6} {:>8} {:>6} {:>8.1f} ms".format(
+                name, sf.frame_len, fl_spill, reg_sf.spill_num, stack_memory, memory_operands(bb), alloc_ms))
+
+def bench_linear_scan():
+    # allocation time and memory operands at -O0 with graph coloring and
+    # linear scan, next to the StackFrame homes. read sum keeps every read
+    # live, so its interference graph is quadratic and coloring stops at
+    # color_max instructions
+    color_max = 20000
+    print("[linear-scan] program, instructions, memory operands with StackFrame, "
+          "ms and memory operands with coloring and linear scan")
+    for name, gen, size_lst in (("read sum", gen_read_sum, (1000, 4000, 16000, 64000)),
+                                ("balanced +", gen_balanced_add, (4000, 16000, 64000, 256000)),
+                                ("half read", gen_half_read, (4000, 16000, 64000))):
+        for size in size_lst:
+            ast = parse(scan(gen(size)))
+            bb = optimize_block(ast, 0)
+            select_instruction(bb)
+            inst_lst = bb.inst_lst
+            assign_home(bb, StackFrame())
+            patch_instruction(bb)
+            row = [len(inst_lst), memory_operands(bb)]
+            for alloc in ("color", "linear"):
+                if alloc == "color" and len(inst_lst) > color_max:
+                    row += ["-", "-"]
+                    continue
+                start = time.perf_counter()
+                if alloc == "color":
+                    sf = color_graph(uncover_live(inst_lst))
+                else:
+                    sf = linear_scan(inst_lst)
+                row.append("{:.1f}".format((time.perf_counter() - start) * 1000))
+                bb.inst_lst = inst_lst
+                assign_home(bb, sf)
+                patch_instruction(bb, "r11")
+                row.append(memory_operands(bb))
+            print("{:>12} ".format(name) + " ".join("{:>9}".format(item) for item in row))
+
+def set_liveness(op_lst):
+    # fl.py's cal_liveness before Liveness, a set copied per instruction,
+    # kept here as the baseline
+    live_set = set()
+    live_after_lst = [live_set]
+    for op in op_lst[:0:-1]:
+        new_live_set = live_set.copy()
+        if op[0] == "addq":
+            for arg in op[1:]:
+                if arg[0] == "var":
+                    new_live_set.add(arg[1])
+        elif op[0] == "movq":
+            if op[1][0] == "var":
+                new_live_set.add(op[1][1])
+            if op[2][0] == "var":
+                new_live_set.discard(op[2][1])
+        live_set = new_live_set
+        live_after_lst.append(live_set)
+    live_after_lst.reverse()
+    return live_after_lst
+
+def gen_live_block(var_num):
+    # selected instructions setting var_num vars and then adding them all
+    # up, so all of them are live at once
+    Symbols.reset()
+    var_lst = [Symbols.get_new_symbol("v") for _ in range(var_num)]
+    op_lst = [("movq", ("int", i), ("var", var_lst[i])) for i in range(var_num)]
+    sum_var = ("var", Symbols.get_new_symbol("sum"))
+    op_lst.append(("movq", ("int", 0), sum_var))
+    op_lst += [("addq", ("var", var), sum_var) for var in var_lst]
+    op_lst.append(("movq", sum_var, ("reg", "rax")))
+    return op_lst
+
+def bench_liveness():
+    print("[liveness] vars live at once, seconds and peak MB with a set per instruction and with fl.Liveness")
+    for var_num in (500, 1000, 2000, 10000, 100000):
+        op_lst = gen_live_block(var_num)
+        row = []
+        for cal in (set_liveness, fl.cal_liveness):
+            if cal is set_liveness and var_num > 2000:
+                row += ["-", "-"]
+                continue
+            row.append("{:.3f}".format(timeit(cal, op_lst)))
+            row.append("{:.1f}".format(peak_memory(cal, op_lst) / 1e6))
+        print("{:>8} ".format(var_num) + " ".join("{:>9}".format(item) for item in row))
+
+def set_interfere(inst_lst):
+    # reg_alloc.py's uncover_live before InterferenceGraph, a set of
+    # neighbours per var filled from a live set, kept here as the baseline
+    adj_dict = {}
+    live_set = set()
+    for inst in reversed(inst_lst):
+        match inst:
+            case [op, src, dest]:
+                src_var = src[1] if src[0] == "var" else None
+                if dest[0] == "var":
+                    dest_var = dest[1]
+                    adj_dict.setdefault(dest_var, set())
+                    for var in live_set:
+                        if var != dest_var and (op != "movq" or var != src_var):
+                            adj_dict[dest_var].add(var)
+                            adj_dict.setdefault(var, set()).add(dest_var)
+                    if op == "movq":
+                        live_set.discard(dest_var)
+                    else:
+                        live_set.add(dest_var)
+                if src_var is not None:
+                    live_set.add(src_var)
+    return adj_dict
+
+def bench_interference():
+    # read sum at -O0 keeps every read live to the end, so the graph is
+    # near complete: the sets stop at set_max nodes
+    set_max = 4000
+    print("[interference] reads, nodes, edges, seconds and peak MB with a set per var and with InterferenceGraph")
+    for read_num in (1000, 2000, 4000, 8000, 16000):
+        bb = optimize_block(parse(scan(gen_read_sum(read_num))), 0)
+        select_instruction(bb)
+        graph = uncover_live(bb.inst_lst)
+        row = [len(graph), sum(graph.degree_lst) // 2]
+        for build in (set_interfere, uncover_live):
+            if build is set_interfere and len(graph) > set_max:
+                row += ["-", "-"]
+                continue
+            row.append("{:.3f}".format(timeit(build, bb.inst_lst)))
+            row.append("{:.1f}".format(peak_memory(build, bb.inst_lst) / 1e6))
+        print("{:>8} ".format(read_num) + " ".join("{:>10}".format(item) for item in row))
+
+def bench_coalesce():
+    # movqs left after patch_instruction, all of them and those from a
+    # register to a register, with coloring without and with coalescing,
+    # and the ms allocation takes with it. check_regalloc runs the coalesced
+    # code, moves merged into rax included
+    check_regalloc()
+    programs = list(test_corpus()) + synthetic_programs() + \
+        [("read sum", gen_read_sum(256)), ("right heavy", gen_right_heavy(200))]
+    for opt_level in (0, 1):
+        print("[coalesce] program, movqs and register movqs with no coalescing and with it at -O{}, ms".format(opt_level))
+        for name, code in programs:
+            row = []
+            for coalesce_move in (False, True):
+                bb = optimize_block(parse(scan(code)), opt_level)
+                select_instruction(bb)
+                start = time.perf_counter()
+                sf = color_graph(uncover_live(bb.inst_lst), REG_LST, coalesce_move)
+                alloc_ms = (time.perf_counter() - start) * 1000
+                assign_home(bb, sf)
+                patch_instruction(bb, "r11")
+                move_lst = [inst for inst in bb.inst_lst if inst[0] == "movq"]
+                row.append(len(move_lst))
+                row.append(sum(1 for inst in move_lst if inst[1][0] == "reg" and inst[2][0] == "reg"))
+            print("{:>14} {:>6} {:>6} {:>6} {:>6} {:>8.1f} ms".format(name, *row, alloc_ms))
+
+BENCHES = {
+    "parse": bench_parse,
+    "scan": bench_scan,
+    "deep": bench_deep,
+    "arena": bench_arena,
+    "symbols": bench_symbols,
+    "scope": bench_scope,
+    "fused": bench_fused,
+    "hash-cons": bench_hash_cons,
+    "printer": bench_printer,
+    "fold": bench_fold,
+    "copy-prop": bench_copy_prop,
+    "cse": bench_cse,
+    "reassoc": bench_reassoc,
+    "ilp": bench_ilp,
+    "su": bench_su,
+    "const": bench_const,
+    "bind": bench_bind,
+    "ssa": bench_ssa,
+    "superopt": bench_superopt,
+    "regalloc": bench_regalloc,
+    "linear-scan": bench_linear_scan,
+    "liveness": bench_liveness,
+    "interference": bench_interference,
+    "coalesce": bench_coalesce,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHES:
+        BENCHES[name]()
@@ -1,48 +1,10 @@
+import io
 import queue
-
-def scan(code):
-    return code.replace("(", " ( ").replace(")", " ) ").split()
-
-def parse(tokens):
-    if len(tokens) == 0:
-        raise SyntaxError("Parse Err: Unexpected EOF")
-    token = tokens.pop(0)
-    if token == '(':
-        exp_lst = [tokens.pop(0)]       # op
-        while tokens[0] != ')':
-            exp_lst.append(parse(tokens))
-        tokens.pop(0)    # pop off ')'
-        return exp_lst
-    elif token == ')':
-        raise SyntaxError('Parse Err: Unexpected )')
-    elif token[0].isdigit() or token[0] == "-":
-        return ["int", int(token)]
-    else:
-        return ["var", token]
-
-class Symbols:
-    symbol_dict = {}
-
-    @staticmethod
-    def get_new_symbol(var):
-        if var not in Symbols.symbol_dict:
-            Symbols.symbol_dict[var] = 1
-        else:
-            Symbols.symbol_dict[var] += 1
-        return var + "." + str(Symbols.symbol_dict[var])
-
-class Senv:
-
-    def __init__(self, old_env, key, new_name):
-        self.old_env = old_env
-        self.key = key
-        self.new_name = new_name
-    
-    def find(self, key):
-        if key == self.key:
-            return self.new_name
-        else:
-            return self.old_env.find(key)
+import sys
+from array import array
+from reader import scan, parse
+from symbols import Symbols, ScopedEnv
+from printer import write_exp, write_line
 
 class BasicBlock:
 
@@ -54,10 +16,16 @@ class BasicBlock:
         self.inst_lst.append(op)
 
     def __str__(self):
-        rest = self.block_name + "\n"
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    def write(self, out):
+        out.write(self.block_name + "\n")
         for op in self.inst_lst:
-            rest += "\t" + str(op) + "\n"
-        return rest
+            out.write("\t")
+            write_exp(op, out)
+            out.write("\n")
 
 def uniquify(exp, env):
     match exp:
@@ -72,26 +40,51 @@ def uniquify(exp, env):
         case ["let", [var, value], let_exp]:
             new_value = uniquify(value, env)
             new_var = Symbols.get_new_symbol(var)
-            new_env = Senv(env, var, new_var)
-            return ["let", [new_var, new_value], uniquify(let_exp, new_env)]
+            env.bind(var, new_var)
+            new_let_exp = uniquify(let_exp, env)
+            env.unbind()
+            return ["let", [new_var, new_value], new_let_exp]
+
+def su_need(exp, swap_set):
+    # Sethi-Ullman number: how many values are live at once while exp is
+    # computed, 0 for an atom. The + whose arg2 needs more go in swap_set,
+    # flatten computes their arg2 first
+    match exp:
+        case [("var" | "int"), _]:
+            return 0
+        case ["+", arg1, arg2]:
+            need1 = su_need(arg1, swap_set)
+            need2 = su_need(arg2, swap_set)
+            if 0 < need1 < need2:
+                swap_set.add(id(exp))
+                need1, need2 = need2, need1
+            return max(need1, (1 if need1 > 0 else 0) + need2, 1)
+        case ["let", [var, value], let_exp]:
+            return max(su_need(value, swap_set), 1 + su_need(let_exp, swap_set))
 
-def flatten(exp, dest, bb):
+def flatten(exp, dest, bb, swap_set=()):
     match exp:
         case [("var" | "int"), _]:
             bb.append(["assign", dest, exp])
+        case ["+", arg1, arg2] if id(exp) in swap_set:
+            tmp_var2 = ["var", Symbols.get_new_symbol("tmp")]
+            flatten(arg2, tmp_var2, bb, swap_set)
+            tmp_var1 = ["var", Symbols.get_new_symbol("tmp")]
+            flatten(arg1, tmp_var1, bb, swap_set)
+            bb.append(["assign", dest, ["+", tmp_var1, tmp_var2]])
         case ["+", arg1, arg2]:
             if arg1[0] not in ("int", "var"):
                 tmp_var = ["var", Symbols.get_new_symbol("tmp")]
-                flatten(arg1, tmp_var, bb)
+                flatten(arg1, tmp_var, bb, swap_set)
                 arg1 = tmp_var
             if arg2[0] not in ("int", "var"):
                 tmp_var = ["var", Symbols.get_new_symbol("tmp")]
-                flatten(arg2, tmp_var, bb)
+                flatten(arg2, tmp_var, bb, swap_set)
                 arg2 = tmp_var
             bb.append(["assign", dest, ["+", arg1, arg2]])
         case ["let", [var, value], let_exp]:
-            flatten(value, ["var", var], bb)
-            flatten(let_exp, dest, bb)
+            flatten(value, ["var", var], bb, swap_set)
+            flatten(let_exp, dest, bb, swap_set)
 
 def select_instruction(bb):
     old_inst_lst = bb.inst_lst
@@ -104,62 +97,139 @@ def select_instruction(bb):
             case [_, dest, src]:
                 bb.append(["movq", src, dest])
 
+class LiveAfter:
+    # liveness[i], the vars live after instruction i, as a view
+
+    def __init__(self, liveness, pos):
+        self.liveness = liveness
+        self.pos = pos
+
+    def __contains__(self, var):
+        return self.liveness.is_live_after(self.pos, var)
+
+    def __iter__(self):
+        # a membership test is O(1), a walk goes through Liveness.live_set
+        return iter(self.liveness.live_set(self.pos))
+
+class Liveness:
+    # the live vars after each instruction, indexed like the list of sets
+    # cal_liveness used to return, with no set per instruction. One
+    # backward sweep over a flag per symbol id keeps the deltas: for every
+    # instruction the var its movq makes live and its vars that are dead
+    # after it, and for every var its live ranges, so memory is linear in
+    # the block plus the vars. A var is live after i for start <= i < end,
+    # one range per def that is used, and more_range_dict holds the ranges
+    # of vars assigned more than once
+
+    def __init__(self, op_lst):
+        var_num = Symbols.symbol_num()
+        self.born_lst = array("q", [-1]) * len(op_lst)
+        self.dead1_lst = array("q", [-1]) * len(op_lst)
+        self.dead2_lst = array("q", [-1]) * len(op_lst)
+        self.start_lst = array("q", [-1]) * var_num
+        self.end_lst = array("q", [-1]) * var_num
+        self.more_range_dict = {}
+        live_lst = bytearray(var_num)
+        for i in range(len(op_lst) - 1, -1, -1):
+            op, arg1, arg2 = op_lst[i]
+            var1 = arg1[1] if arg1[0] == "var" else -1
+            var2 = arg2[1] if arg2[0] == "var" else -1
+            if var1 >= 0 and not live_lst[var1]:
+                self.dead1_lst[i] = var1
+            if var2 >= 0 and not live_lst[var2] and var2 != var1:
+                self.dead2_lst[i] = var2
+            if var2 >= 0:
+                if op == "movq":
+                    if live_lst[var2]:
+                        self.born_lst[i] = var2
+                        self.start_lst[var2] = i
+                        live_lst[var2] = 0
+                elif not live_lst[var2]:
+                    self.open_range(var2, i)
+                    live_lst[var2] = 1
+            if var1 >= 0 and not live_lst[var1]:
+                self.open_range(var1, i)
+                live_lst[var1] = 1
+        self.live_in_lst = [var for var in range(var_num) if live_lst[var]]
+        self.cursor_pos = -1
+        self.cursor_set = set(self.live_in_lst)
+
+    def open_range(self, var, pos):
+        # going backward, var is used at pos and not live after it. Its
+        # range is open until the def before sets its start
+        if self.end_lst[var] >= 0:
+            self.more_range_dict.setdefault(var, []).append((self.start_lst[var], self.end_lst[var]))
+        self.start_lst[var] = -1
+        self.end_lst[var] = pos
+
+    def __len__(self):
+        return len(self.born_lst)
+
+    def __getitem__(self, pos):
+        return LiveAfter(self, pos)
+
+    def is_live_after(self, pos, var):
+        if self.start_lst[var] <= pos < self.end_lst[var]:
+            return True
+        for start, end in self.more_range_dict.get(var, ()):
+            if start <= pos < end:
+                return True
+        return False
+
+    def dead_lst(self, pos):
+        return [var for var in (self.dead1_lst[pos], self.dead2_lst[pos]) if var >= 0]
+
+    def live_set(self, pos):
+        # replays the deltas from a cursor left at the last pos asked for,
+        # so walking forward costs the deltas passed over plus the copy.
+        # Going back starts over from the live in vars
+        if pos < self.cursor_pos:
+            self.cursor_pos = -1
+            self.cursor_set = set(self.live_in_lst)
+        live_set = self.cursor_set
+        for i in range(self.cursor_pos + 1, pos + 1):
+            live_set.difference_update(self.dead_lst(i))
+            if self.born_lst[i] >= 0:
+                live_set.add(self.born_lst[i])
+        self.cursor_pos = pos
+        return set(live_set)
+
 def cal_liveness(op_lst):
-    live_set = set()
-    live_after_lst = [live_set]
-    for op in op_lst[:0:-1]:
-        new_live_set = live_set.copy()
-        if op[0] == "addq":
-            add_exp1 = op[1]
-            add_exp2 = op[2]
-            if add_exp1[0] == "var":
-                new_live_set.add(add_exp1[1])
-            if add_exp2[0] == "var":
-                new_live_set.add(add_exp2[1])
-        elif op[0] == "movq":
-            from_exp = op[1]
-            to_exp = op[2]
-            if from_exp[0] == "var":
-                new_live_set.add(from_exp[1])
-            if to_exp[0] == "var":
-                new_live_set.discard(to_exp[1])
-        live_set = new_live_set
-        live_after_lst.append(live_set)
-    live_after_lst.reverse()
-    return live_after_lst
+    return Liveness(op_lst)
 
 class StackFrame:
 
     def __init__(self):
-        self.symbol_pos_dict = {}
+        self.symbol_pos_lst = array("q", [-1]) * Symbols.symbol_num()
         self.pos_var_count = []
         self.frame_len = 0
         self.alloc_reg_lst = ["rcx", "rdx"]
         self.alloc_queue = queue.PriorityQueue()
 
     def mark_del(self, var):
-        pos = self.symbol_pos_dict[var]
+        pos = self.symbol_pos_lst[var]
         self.pos_var_count[pos] -= 1
         if self.pos_var_count[pos] == 0:
             self.alloc_queue.put(pos)
     
     def alias_var(self, new_var, old_var):
-        pos = self.symbol_pos_dict[old_var]
-        self.symbol_pos_dict[new_var] = pos
+        pos = self.symbol_pos_lst[old_var]
+        self.symbol_pos_lst[new_var] = pos
         self.pos_var_count[pos] += 1
 
     def get_var_pos(self, arg):
         if arg[0] != "var":
             return arg
         var = arg[1]
-        if var not in self.symbol_pos_dict:
+        if self.symbol_pos_lst[var] < 0:
             if self.alloc_queue.empty():
-                self.symbol_pos_dict[var] = self.frame_len
+                self.symbol_pos_lst[var] = self.frame_len
                 self.frame_len = self.frame_len + 1
                 self.pos_var_count.append(1)
             else:
-                self.symbol_pos_dict[var] = self.alloc_queue.get()
-        pos = self.symbol_pos_dict[var]
+                self.symbol_pos_lst[var] = self.alloc_queue.get()
+                self.pos_var_count[self.symbol_pos_lst[var]] = 1
+        pos = self.symbol_pos_lst[var]
         reg_num = len(self.alloc_reg_lst)
         if pos < reg_num:
             return ("reg", self.alloc_reg_lst[pos])
@@ -176,24 +246,16 @@ class StackFrame:
 
 def assign_home(op_lst, liv_lst, sf):
     new_op_lst = []
-    liv_before_set = set()
     for i in range(len(op_lst)):
         inst = op_lst[i]
-        liv_after = liv_lst[i]
         if inst[0] == "movq" and inst[1][0] == "var" \
-            and inst[2][0] == "var" and inst[1][1] not in liv_after:
+            and inst[2][0] == "var" and inst[1][1] not in liv_lst[i]:
             sf.alias_var(inst[2][1], inst[1][1])
         new_op_lst.append((inst[0], 
                             sf.get_var_pos(inst[1]), 
                             sf.get_var_pos(inst[2])))
-        if inst[1][0] == "var":
-            liv_before_set.add(inst[1][1])
-        if inst[2][0] == "var":
-            liv_before_set.add(inst[2][1])
-        dead_set = liv_before_set - liv_after
-        for var in dead_set:
+        for var in liv_lst.dead_lst(i):
             sf.mark_del(var)
-        liv_before_set = liv_after
     return new_op_lst
 
 def patch_instuction(op_lst):
@@ -235,48 +297,51 @@ def print_x84_64(op_lst, sf):
     print("    popq %rbp")
     print("    retq")
 
-code = "1"
-# code = "(let (x (let (x 100000000) (+ x 200000000))) (+ x 300000000))"
-# code ="""
-# (let (a 1)
-#     (let (b a)
-#         1)
-# )
-# """
-# code = "(let (x (let (x 100000000) (+ 200000000 x))) (+ x 300000000))"
+if __name__ == "__main__":
+    code = "1"
+    # code = "(let (x (let (x 100000000) (+ x 200000000))) (+ x 300000000))"
+    # code ="""
+    # (let (a 1)
+    #     (let (b a)
+    #         1)
+    # )
+    # """
+    # code = "(let (x (let (x 100000000) (+ 200000000 x))) (+ x 300000000))"
 
-ast = parse(scan(code))
-print(ast)
+    ast = parse(scan(code))
+    print(ast)
 
-print("\n[Unify]")
-u_ast = uniquify(ast, None)
-print(u_ast)
+    print("\n[Unify]")
+    u_ast = uniquify(ast, ScopedEnv())
+    write_line(u_ast, sys.stdout)
 
-print("\n[Flatten]")
-start_bb = BasicBlock("start")
-flatten(u_ast, ["reg", "rax"], start_bb)
-print(start_bb)
+    print("\n[Flatten]")
+    start_bb = BasicBlock("start")
+    swap_set = set()
+    su_need(u_ast, swap_set)
+    flatten(u_ast, ["reg", "rax"], start_bb, swap_set)
+    print(start_bb)
 
-print("\n[SELECT INSTRUCTION]")
-select_instruction(start_bb)
-print(start_bb)
+    print("\n[SELECT INSTRUCTION]")
+    select_instruction(start_bb)
+    print(start_bb)
 
 
-# select_op_lst = select_instruction(flatten_op_lst)
-# print_op_lst("[SELECT OP]", select_op_lst)
+    # select_op_lst = select_instruction(flatten_op_lst)
+    # print_op_lst("[SELECT OP]", select_op_lst)
 
-# liveness_lst = cal_liveness(select_op_lst)
-# print_op_lst("[LIVENESS ANALYZE]", liveness_lst)
+    # liveness_lst = cal_liveness(select_op_lst)
+    # print_op_lst("[LIVENESS ANALYZE]", liveness_lst)
 
-# stack_frame = StackFrame()
-# assign_home_op_lst = assign_home(select_op_lst, liveness_lst, stack_frame)
-# print("\n[STACK POS]")
-# print(stack_frame.symbol_pos_dict)
-# print("")
+    # stack_frame = StackFrame()
+    # assign_home_op_lst = assign_home(select_op_lst, liveness_lst, stack_frame)
+    # print("\n[STACK POS]")
+    # print(stack_frame.symbol_pos_lst)
+    # print("")
 
-# print_op_lst("[ASSIGN HOME]", assign_home_op_lst)
+    # print_op_lst("[ASSIGN HOME]", assign_home_op_lst)
 
-# patch_op_lst = patch_instuction(assign_home_op_lst)
-# print_op_lst("[PATCH OP]", patch_op_lst)
+    # patch_op_lst = patch_instuction(assign_home_op_lst)
+    # print_op_lst("[PATCH OP]", patch_op_lst)
 
-# print_x84_64(patch_op_lst, stack_frame)
+    # print_x84_64(patch_op_lst, stack_frame)
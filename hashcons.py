@@ -0,0 +1,27 @@
+class HashCons:
+    # one shared node per structure. Children are shared before their parent,
+    # so a node is keyed by its own fields and the identity of its children,
+    # and `a is b` tells two nodes of one table are structurally equal.
+    # Shared ["read"] nodes are still separate reads at run time.
+
+    def __init__(self):
+        self.node_dict = {}
+
+    def __len__(self):
+        return len(self.node_dict)
+
+    def node(self, exp):
+        match exp:
+            case ["int", i]:
+                key = ("int", i)
+            case ["var", var]:
+                key = ("var", var)
+            case ["read"]:
+                key = ("read",)
+            case ["+", arg1, arg2]:
+                key = ("+", id(arg1), id(arg2))
+            case ["let", [var, value], let_exp]:
+                key = ("let", var, id(value), id(let_exp))
+            case _:
+                return exp
+        return self.node_dict.setdefault(key, exp)
@@ -1,51 +1,17 @@
-import sys
-
-def debug(str):
-    print(str, file=sys.stderr)
-
-def scan(code):
-    return code.replace("(", " ( ").replace(")", " ) ").split()
-
-def parse(tokens):
-    if len(tokens) == 0:
-        raise SyntaxError("Parse Err: Unexpected EOF")
-    token = tokens.pop(0)
-    if token == '(':
-        exp_lst = [tokens.pop(0)]       # op
-        while tokens[0] != ')':
-            exp_lst.append(parse(tokens))
-        tokens.pop(0)    # pop off ')'
-        return exp_lst
-    elif token == ')':
-        raise SyntaxError('Parse Err: Unexpected )')
-    elif token[0].isdigit() or token[0] == "-":
-        return ["int", int(token)]
-    else:
-        return ["var", token]
-
-class Symbols:
-    symbol_dict = {}
-
-    @staticmethod
-    def get_new_symbol(var):
-        if var not in Symbols.symbol_dict:
-            Symbols.symbol_dict[var] = 1
-        else:
-            Symbols.symbol_dict[var] += 1
-        return var + "." + str(Symbols.symbol_dict[var])
-
-class Senv:
+import argparse
+import io
+from array import array
+from reader import open_source, scan, parse
+from symbols import Symbols, ScopedEnv
+from printer import DUMP_PASSES, Dumper, write_exp
+from hashcons import HashCons
+from ssa import to_ssa, eliminate_dead_values, from_ssa
+from superopt import apply_rules
+from opt import bind_reads, const_eval, partial_eval, uniquify_partial_eval, reassociate, copy_propagate, value_number, dead_code_eliminate
 
-    def __init__(self, old_env, key, new_name):
-        self.old_env = old_env
-        self.key = key
-        self.new_name = new_name
-    
-    def find(self, key):
-        if key == self.key:
-            return self.new_name
-        else:
-            return self.old_env.find(key)
+# registers left to hold partial sums: the caller saved ones but rax and
+# r11, which patch_instruction uses as scratch
+SUM_REG_NUM = 7
 
 def trans_operand_to_str(operand):
     match operand:
@@ -55,6 +21,8 @@ def trans_operand_to_str(operand):
             return "{}(%{})".format(offset, reg)
         case ["reg", reg]:
             return "%" + reg
+        case ["lea", base, index, disp]:
+            return "{}(%{}{})".format("" if disp is None else disp, base, "" if index is None else ",%" + index)
 
 class BasicBlock:
 
@@ -67,10 +35,16 @@ class BasicBlock:
         self.inst_lst.append(op)
 
     def __str__(self):
-        rest = self.block_name + "\n"
+        out = io.StringIO()
+        self.write(out)
+        return out.getvalue()
+
+    def write(self, out):
+        out.write(self.block_name + "\n")
         for op in self.inst_lst:
-            rest += "\t" + str(op) + "\n"
-        return rest
+            out.write("\t")
+            write_exp(op, out)
+            out.write("\n")
     
     def print_code(self):
         print("_" + self.block_name + ":")
@@ -86,17 +60,18 @@ class BasicBlock:
 class StackFrame:
 
     def __init__(self):
-        self.symbol_pos_dict = {}
+        self.symbol_pos_lst = array("q", [-1]) * Symbols.symbol_num()
         self.frame_len = 0
 
     def get_var_pos(self, arg):
         if arg[0] != "var":
             return arg
         var = arg[1]
-        if var not in self.symbol_pos_dict:
-            self.symbol_pos_dict[var] = self.frame_len
+        pos = self.symbol_pos_lst[var]
+        if pos < 0:
+            pos = self.frame_len
+            self.symbol_pos_lst[var] = pos
             self.frame_len += 1
-        pos = self.symbol_pos_dict[var]
         return ("deref", "rbp", -8 * (pos + 1))
     
     def get_frame_size(self):
@@ -105,43 +80,175 @@ class StackFrame:
             frame_size += 1
         return frame_size * 8
 
-def uniquify(exp, env):
-    match exp:
-        case ["read"]:
-            return exp
-        case ["var", var]:
-            return ["var", env.find(var)]
-        case ["int", i]:
-            return exp
-        case ["+", arg1, arg2]:
-            new_arg1 = uniquify(arg1, env)
-            new_arg2 = uniquify(arg2, env)
-            return ["+", new_arg1, new_arg2]
-        case ["let", [var, value], let_exp]:
-            new_value = uniquify(value, env)
-            new_var = Symbols.get_new_symbol(var)
-            new_env = Senv(env, var, new_var)
-            return ["let", [new_var, new_value], uniquify(let_exp, new_env)]
-
-def flatten(exp, dest, bb):
-    match exp:
-        case ["read"]:
-            bb.append(["assign", dest, ["func", "read_int"]])
-        case [("var" | "int"), _]:
-            bb.append(["assign", dest, exp])
-        case ["+", arg1, arg2]:
-            if arg1[0] not in ("int", "var"):
-                tmp_var = ["var", Symbols.get_new_symbol("tmp")]
-                flatten(arg1, tmp_var, bb)
-                arg1 = tmp_var
-            if arg2[0] not in ("int", "var"):
-                tmp_var = ["var", Symbols.get_new_symbol("tmp")]
-                flatten(arg2, tmp_var, bb)
-                arg2 = tmp_var
-            bb.append(["assign", dest, ["+", arg1, arg2]])
-        case ["let", [var, value], let_exp]:
-            flatten(value, ["var", var], bb)
-            flatten(let_exp, dest, bb)
+def share(exp, table):
+    if table is None:
+        return exp
+    return table.node(exp)
+
+def uniquify(exp, env, table=None):
+    # explicit work stack, so nesting depth is not bound by the recursion limit.
+    # table: a HashCons to share structurally identical renamed nodes
+    work_lst = [("exp", exp)]
+    result_lst = []
+    while work_lst:
+        match work_lst.pop():
+            case ["exp", exp]:
+                match exp:
+                    case ["read"]:
+                        result_lst.append(share(exp, table))
+                    case ["var", var]:
+                        result_lst.append(share(["var", env.find(var)], table))
+                    case ["int", i]:
+                        result_lst.append(share(exp, table))
+                    case ["+", arg1, arg2]:
+                        work_lst.append(("+",))
+                        work_lst.append(("exp", arg2))
+                        work_lst.append(("exp", arg1))
+                    case ["let", [var, value], let_exp]:
+                        work_lst.append(("bind", var, let_exp))
+                        work_lst.append(("exp", value))
+            case ["+"]:
+                new_arg2 = result_lst.pop()
+                new_arg1 = result_lst.pop()
+                result_lst.append(share(["+", new_arg1, new_arg2], table))
+            case ["bind", var, let_exp]:
+                # the value is renamed before the new symbol is taken
+                new_var = Symbols.get_new_symbol(var)
+                env.bind(var, new_var)
+                work_lst.append(("let", new_var))
+                work_lst.append(("exp", let_exp))
+            case ["let", new_var]:
+                env.unbind()
+                new_let_exp = result_lst.pop()
+                new_value = result_lst.pop()
+                result_lst.append(share(["let", [new_var, new_value], new_let_exp], table))
+    return result_lst.pop()
+
+def su_swap_set(exp):
+    # Sethi-Ullman numbers: need is how many values are live at once while
+    # a node is computed, 0 for an atom. A + is flattened arg2 first when
+    # arg2 needs more, so the smaller side is the one computed while the
+    # other's tmp is held. Both sides must be non-atoms, and not both may
+    # read, so reads keep their order. Returns the ids of the + to swap
+    su_dict = {}
+    swap_set = set()
+    work_lst = [(False, exp)]
+    while work_lst:
+        done, exp = work_lst.pop()
+        if not done and id(exp) in su_dict:
+            continue
+        match exp:
+            case [("var" | "int"), _]:
+                su_dict[id(exp)] = (0, False)
+            case ["read"]:
+                su_dict[id(exp)] = (1, True)
+            case ["+", arg1, arg2] | ["let", [_, arg1], arg2] if not done:
+                work_lst.append((True, exp))
+                work_lst.append((False, arg2))
+                work_lst.append((False, arg1))
+            case ["+", arg1, arg2]:
+                need1, read1 = su_dict[id(arg1)]
+                need2, read2 = su_dict[id(arg2)]
+                if 0 < need1 < need2 and not (read1 and read2):
+                    swap_set.add(id(exp))
+                    need1, need2 = need2, need1
+                su_dict[id(exp)] = (max(need1, (1 if need1 > 0 else 0) + need2, 1), read1 or read2)
+            case ["let", [_, value], let_exp]:
+                value_need, value_read = su_dict[id(value)]
+                let_need, let_read = su_dict[id(let_exp)]
+                su_dict[id(exp)] = (max(value_need, 1 + let_need), value_read or let_read)
+    return swap_set
+
+def flatten(exp, dest, bb, reorder=False):
+    # reorder flattens the hungrier side of a + first, see su_swap_set
+    swap_set = su_swap_set(exp) if reorder else ()
+    work_lst = [("exp", exp, dest)]
+    while work_lst:
+        match work_lst.pop():
+            case ["exp", exp, dest]:
+                match exp:
+                    case ["read"]:
+                        bb.append(["assign", dest, ["func", "read_int"]])
+                    case [("var" | "int"), _]:
+                        bb.append(["assign", dest, exp])
+                    case ["+", arg1, arg2] if id(exp) in swap_set:
+                        tmp_var2 = ["var", Symbols.get_new_symbol("tmp")]
+                        tmp_var1 = ["var", Symbols.get_new_symbol("tmp")]
+                        work_lst.append(("add", dest, tmp_var1, tmp_var2))
+                        work_lst.append(("exp", arg1, tmp_var1))
+                        work_lst.append(("exp", arg2, tmp_var2))
+                    case ["+", arg1, arg2]:
+                        if arg1[0] not in ("int", "var"):
+                            tmp_var = ["var", Symbols.get_new_symbol("tmp")]
+                            work_lst.append(("arg2", dest, tmp_var, arg2))
+                            work_lst.append(("exp", arg1, tmp_var))
+                        else:
+                            work_lst.append(("arg2", dest, arg1, arg2))
+                    case ["let", [var, value], let_exp]:
+                        work_lst.append(("exp", let_exp, dest))
+                        work_lst.append(("exp", value, ["var", var]))
+            case ["arg2", dest, arg1, arg2]:
+                # arg1 is done, its tmps are taken before the ones of arg2
+                if arg2[0] not in ("int", "var"):
+                    tmp_var = ["var", Symbols.get_new_symbol("tmp")]
+                    work_lst.append(("add", dest, arg1, tmp_var))
+                    work_lst.append(("exp", arg2, tmp_var))
+                else:
+                    bb.append(["assign", dest, ["+", arg1, arg2]])
+            case ["add", dest, arg1, arg2]:
+                bb.append(["assign", dest, ["+", arg1, arg2]])
+
+def rename_atom(atom, env):
+    if atom[0] == "var":
+        return ["var", env.find(atom[1])]
+    return atom
+
+UNBIND = ("unbind",)
+
+def uniquify_flatten(exp, env, dest, bb):
+    # uniquify and flatten in one walk, the renamed AST is never built.
+    # Symbols are taken in the same order as the two passes: a let var
+    # after its value is flattened (its dest is filled in then), tmps of
+    # arg1 before the ones of arg2. There is no Sethi-Ullman swap here, it
+    # would flatten a let before lets that come ahead of it in the source
+    # and so number it differently than uniquify; -O1 --fused flattens
+    # the result of uniquify_partial_eval instead
+    work_lst = [("exp", exp, dest)]
+    while work_lst:
+        match work_lst.pop():
+            case ["exp", exp, dest]:
+                match exp:
+                    case ["read"]:
+                        bb.append(["assign", dest, ["func", "read_int"]])
+                    case [("var" | "int"), _]:
+                        bb.append(["assign", dest, rename_atom(exp, env)])
+                    case ["+", arg1, arg2]:
+                        if arg1[0] not in ("int", "var"):
+                            tmp_var = ["var", Symbols.get_new_symbol("tmp")]
+                            work_lst.append(("arg2", dest, tmp_var, arg2))
+                            work_lst.append(("exp", arg1, tmp_var))
+                        else:
+                            work_lst.append(("arg2", dest, rename_atom(arg1, env), arg2))
+                    case ["let", [var, value], let_exp]:
+                        var_dest = ["var", None]
+                        work_lst.append(("bind", var, var_dest, let_exp, dest))
+                        work_lst.append(("exp", value, var_dest))
+            case ["bind", var, var_dest, let_exp, dest]:
+                var_dest[1] = Symbols.get_new_symbol(var)
+                env.bind(var, var_dest[1])
+                work_lst.append(UNBIND)
+                work_lst.append(("exp", let_exp, dest))
+            case ["unbind"]:
+                env.unbind()
+            case ["arg2", dest, arg1, arg2]:
+                if arg2[0] not in ("int", "var"):
+                    tmp_var = ["var", Symbols.get_new_symbol("tmp")]
+                    work_lst.append(("add", dest, arg1, tmp_var))
+                    work_lst.append(("exp", arg2, tmp_var))
+                else:
+                    bb.append(["assign", dest, ["+", arg1, rename_atom(arg2, env)]])
+            case ["add", dest, arg1, arg2]:
+                bb.append(["assign", dest, ["+", arg1, arg2]])
 
 def select_instruction(bb):
     old_inst_lst = bb.inst_lst
@@ -154,6 +261,8 @@ def select_instruction(bb):
             case [_, dest, ["func", func]]:
                 bb.append(["callq", ["func", func]])
                 bb.append(["movq", ["reg", "rax"], dest])
+            case ["call", ["func", func]]:
+                bb.append(["callq", ["func", func]])
             case [_, dest, src]:
                 bb.append(["movq", src, dest])
 
@@ -167,14 +276,26 @@ def assign_home(bb, sf):
             case [op, arg1]:
                 bb.append([op, sf.get_var_pos(arg1)])
 
-def patch_instruction(bb):
+def is_imm32(i):
+    return -(1 << 31) <= i < (1 << 31)
+
+def patch_instruction(bb, scratch_reg="rax"):
+    # scratch_reg is free between instructions, r11 once vars may live in rax
     old_inst_lst = bb.inst_lst
     bb.inst_lst = []
     for inst in old_inst_lst:
         match inst:
             case [op, ["deref", var1, offset1], ["deref", var2, offset2]]:
-                bb.append(["movq", ["deref", var1, offset1], ["reg", "rax"]])
-                bb.append([op, ["reg", "rax"], ["deref", var2, offset2]])
+                bb.append(["movq", ["deref", var1, offset1], ["reg", scratch_reg]])
+                bb.append([op, ["reg", scratch_reg], ["deref", var2, offset2]])
+            case ["movq", src, dest] if src == dest:
+                # a copy between vars that got the same register
+                pass
+            case [op, ["int", i], dest] if not is_imm32(i) and (op != "movq" or dest[0] != "reg"):
+                # only movq into a register takes a 64 bit immediate
+                scratch = ["reg", "r11"] if dest[0] == "reg" and dest[1] == scratch_reg else ["reg", scratch_reg]
+                bb.append(["movq", ["int", i], scratch])
+                bb.append([op, scratch, dest])
             case default:
                 bb.append(inst)
 
@@ -194,31 +315,129 @@ def print_x84_64(bb, sf):
     
     bb.print_code()
 
-code = sys.stdin.read()
+def print_const_main(value):
+    # a program with no (read) is just its value, returned like _conclusion does
+    print("    .global _main")
+    print("_main:")
+    print("    movq $" + str(value) + ", %rax")
+    print("    retq")
+
+def int_lst(text):
+    return [int(value) for value in text.split(",")]
+
+def make_arg_parser():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("source", nargs="?", help="source file, stdin if not given")
+    arg_parser.add_argument("--fused", action="store_true",
+                            help="uniquify and flatten in one walk, without the renamed AST "
+                                 "(at -O1 uniquify and partial evaluation are the fused walk)")
+    arg_parser.add_argument("--hash-cons", action="store_true",
+                            help="share structurally identical AST nodes")
+    arg_parser.add_argument("-O", dest="opt_level", type=int, default=1, metavar="LEVEL",
+                            help="0 no optimization, 1 whole program evaluation without reads, partial evaluation, "
+                                 "Sethi-Ullman ordering, copy propagation, "
+                                 "reassociation, value numbering, dead code elimination and the superopt.py rules (default)")
+    arg_parser.add_argument("--balance", type=int, default=1, metavar="WIDTH",
+                            help="at -O1, add long sums as WIDTH independent partial sums "
+                                 "(1 is one chain and the default, 4 is a good start)")
+    arg_parser.add_argument("--ssa", action="store_true",
+                            help="take the flattened block through SSA form and back")
+    arg_parser.add_argument("--bind-reads", type=int_lst, metavar="V1,V2,...",
+                            help="compile for these (read) results, in evaluation order; "
+                                 "write --bind-reads=-1,2 for a negative first value")
+    arg_parser.add_argument("-d", "--dump", type=int, default=0, metavar="LEVEL",
+                            help="0 no dumps, 1 pass headers, 2 headers and IR, to stderr")
+    arg_parser.add_argument("--dump-pass", action="append", choices=DUMP_PASSES,
+                            help="only dump after this pass, can be given more than once")
+    return arg_parser
+
+def parse_args(arg_parser):
+    args = arg_parser.parse_args()
+    if not 1 <= args.balance <= SUM_REG_NUM:
+        arg_parser.error("--balance WIDTH must be between 1 and {}".format(SUM_REG_NUM))
+    return args
+
+def compile_to_block(args, dumper):
+    # the passes up to select_instruction, shared with let_lan_with_reg_alloc.py.
+    # None if the program was a constant and its main is already printed
+    source = open_source(args.source)
+
+    ast = parse(scan(source), HashCons() if args.hash_cons else None)
+    dumper.dump("parse", None, ast)
+
+    if args.bind_reads is not None:
+        ast = bind_reads(ast, args.bind_reads)
+        dumper.dump("bind_reads", "\n[BIND READS]", ast)
+
+    if args.opt_level >= 1:
+        value = const_eval(ast)
+        if value is not None:
+            dumper.dump("const_eval", "\n[CONST EVAL]", ["int", value])
+            print_const_main(value)
+            return None
+
+    start_bb = BasicBlock("start", "conclusion")
+    if args.fused and args.opt_level >= 1:
+        # partial_eval builds a tree anyway, so it is the walk fused with uniquify
+        pe_ast = uniquify_partial_eval(ast, ScopedEnv())
+        dumper.dump("partial_eval", "\n[Unify+PARTIAL EVAL]", pe_ast)
+        flatten(pe_ast, ["reg", "rax"], start_bb, True)
+        dumper.dump("flatten", "\n[Flatten]", start_bb)
+    elif args.fused:
+        uniquify_flatten(ast, ScopedEnv(), ["reg", "rax"], start_bb)
+        dumper.dump("flatten", "\n[Unify+Flatten]", start_bb)
+    else:
+        u_ast = uniquify(ast, ScopedEnv(), HashCons() if args.hash_cons else None)
+        dumper.dump("uniquify", "\n[Unify]", u_ast)
+
+        if args.opt_level >= 1:
+            u_ast = partial_eval(u_ast)
+            dumper.dump("partial_eval", "\n[PARTIAL EVAL]", u_ast)
+
+        flatten(u_ast, ["reg", "rax"], start_bb, args.opt_level >= 1)
+        dumper.dump("flatten", "\n[Flatten]", start_bb)
+
+    if args.ssa:
+        ssa = to_ssa(start_bb)
+        if args.opt_level >= 1:
+            eliminate_dead_values(ssa)
+        dumper.dump("to_ssa", "\n[SSA]", ssa)
+        from_ssa(ssa, start_bb)
+        dumper.dump("from_ssa", "\n[FROM SSA]", start_bb)
+
+    if args.opt_level >= 1:
+        copy_propagate(start_bb)
+        dumper.dump("copy_propagate", "\n[COPY PROPAGATE]", start_bb)
+        reassociate(start_bb, args.balance)
+        dumper.dump("reassociate", "\n[REASSOCIATE]", start_bb)
+        value_number(start_bb)
+        dumper.dump("value_number", "\n[VALUE NUMBER]", start_bb)
+        dead_code_eliminate(start_bb)
+        dumper.dump("dead_code_eliminate", "\n[DEAD CODE ELIMINATE]", start_bb)
 
-ast = parse(scan(code))
-debug(ast)
+    select_instruction(start_bb)
+    dumper.dump("select_instruction", "\n[SELECT INSTRUCTION]", start_bb)
+    return start_bb
 
-debug("\n[Unify]")
-u_ast = uniquify(ast, None)
-debug(u_ast)
+def main():
+    args = parse_args(make_arg_parser())
+    dumper = Dumper(args.dump, set(args.dump_pass) if args.dump_pass else None)
+    start_bb = compile_to_block(args, dumper)
+    if start_bb is None:
+        return
 
-debug("\n[Flatten]")
-start_bb = BasicBlock("start", "conclusion")
-flatten(u_ast, ["reg", "rax"], start_bb)
-debug(start_bb)
+    sf = StackFrame()
+    assign_home(start_bb, sf)
+    dumper.dump("assign_home", "\n[ASSIGN HOME]", start_bb)
 
-debug("\n[SELECT INSTRUCTION]")
-select_instruction(start_bb)
-debug(start_bb)
+    patch_instruction(start_bb)
+    dumper.dump("patch_instruction", "\n[PATCH INSTRUCTION]", start_bb)
 
-debug("\n[ASSIGN HOME]")
-sf = StackFrame()
-assign_home(start_bb, sf)
-debug(start_bb)
+    if args.opt_level >= 1:
+        apply_rules(start_bb)
+        dumper.dump("superopt", "\n[SUPEROPT]", start_bb)
 
-debug("\n[PATCH INSTRUCTION]")
-patch_instruction(start_bb)
-debug(start_bb)
+    print_x84_64(start_bb, sf)
 
-print_x84_64(start_bb, sf)
+if __name__ == "__main__":
+    main()
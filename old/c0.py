@@ -1,6 +1,9 @@
 # TODO uniquify
+import io
 import sys
 
+from exp_printer import write_exp
+
 
 def error(msg):
     print("Error! " + msg)
@@ -19,10 +22,9 @@ class LetExp:
         self.body_exp = body_exp
 
     def __str__(self):
-        return "(let [" + self.var + " " + \
-               str(self.var_exp).replace("\n", "\n" + " " * (len(self.var) + 7)) + \
-               "]\n  " \
-               + str(self.body_exp).replace("\n", "\n  ") + ")"
+        out = io.StringIO()
+        write_exp(self, out)
+        return out.getvalue()
 
 
 class AddExp:
@@ -31,11 +33,9 @@ class AddExp:
         self.exp2 = exp2
 
     def __str__(self):
-        exp1_str = str(self.exp1)
-        if "\n" in exp1_str:
-            return "(+ " + exp1_str.replace("\n", "\n   ") + "\n   " + str(self.exp2).replace("\n", "\n   ") + ")"
-        else:
-            return "(+ " + exp1_str + " " + str(self.exp2).replace("\n", "\n" + " " * (len(exp1_str) + 4)) + ")"
+        out = io.StringIO()
+        write_exp(self, out)
+        return out.getvalue()
 
 
 def scan(code_str):
@@ -3,15 +3,29 @@ import queue
 def scan(code):
     return code.replace("(", " ( ").replace(")", " ) ").split()
 
-def parse(tokens):
-    if len(tokens) == 0:
-        raise SyntaxError("Parse Err: Unexpected EOF")
-    token = tokens.pop(0)
+class Scanner:
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos >= len(self.tokens):
+            raise SyntaxError("Parse Err: Unexpected EOF")
+        return self.tokens[self.pos]
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+def parse_exp(scanner):
+    token = scanner.next()
     if token == '(':
         exp_lst = []
-        while tokens[0] != ')':
-            exp_lst.append(parse(tokens))
-        tokens.pop(0)    # pop off ')'
+        while scanner.peek() != ')':
+            exp_lst.append(parse_exp(scanner))
+        scanner.next()    # pop off ')'
         return exp_lst
     elif token == ')':
         raise SyntaxError('Parse Err: Unexpected )')
@@ -20,6 +34,9 @@ def parse(tokens):
     else:
         return token
 
+def parse(tokens):
+    return parse_exp(Scanner(tokens))
+
 class Symbols:
     symbol_dict = {}
 
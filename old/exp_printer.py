@@ -0,0 +1,74 @@
+def is_let(exp):
+    return hasattr(exp, "body_exp")
+
+
+def is_add(exp):
+    return hasattr(exp, "exp1")
+
+
+def measure(exp):
+    """
+    后序遍历一次，记下每个节点是否多行，单行时的宽度
+    :param exp:
+    :return: id(node) -> (multi_line, width)
+    """
+    size_dict = {}
+    work_lst = [(exp, False)]
+    while work_lst:
+        node, done = work_lst.pop()
+        if is_let(node):
+            if done:
+                size_dict[id(node)] = (True, 0)
+            else:
+                work_lst.append((node, True))
+                work_lst.append((node.var_exp, False))
+                work_lst.append((node.body_exp, False))
+        elif is_add(node):
+            if done:
+                multi1, width1 = size_dict[id(node.exp1)]
+                multi2, width2 = size_dict[id(node.exp2)]
+                size_dict[id(node)] = (multi1 or multi2, width1 + width2 + 5)
+            else:
+                work_lst.append((node, True))
+                work_lst.append((node.exp1, False))
+                work_lst.append((node.exp2, False))
+        else:
+            size_dict[id(node)] = (False, len(str(node)))
+    return size_dict
+
+
+def write_exp(exp, out):
+    """
+    和原先逐层replace("\n", ...)的排版一样，但直接按缩进写到out里，线性时间
+    :param exp:
+    :param out: 有write方法的文本输出
+    :return:
+    """
+    size_dict = measure(exp)
+    work_lst = [("exp", exp, 0)]
+    while work_lst:
+        kind, item, indent = work_lst.pop()
+        if kind == "text":
+            out.write(item)
+        elif kind == "newline":
+            out.write("\n" + " " * indent)
+        elif is_let(item):
+            out.write("(let [" + item.var + " ")
+            work_lst.append(("text", ")", 0))
+            work_lst.append(("exp", item.body_exp, indent + 2))
+            work_lst.append(("newline", None, indent + 2))
+            work_lst.append(("text", "]", 0))
+            work_lst.append(("exp", item.var_exp, indent + len(item.var) + 7))
+        elif is_add(item):
+            out.write("(+ ")
+            work_lst.append(("text", ")", 0))
+            multi1, width1 = size_dict[id(item.exp1)]
+            if multi1:
+                work_lst.append(("exp", item.exp2, indent + 3))
+                work_lst.append(("newline", None, indent + 3))
+            else:
+                work_lst.append(("exp", item.exp2, indent + width1 + 4))
+                work_lst.append(("text", " ", 0))
+            work_lst.append(("exp", item.exp1, indent + 3))
+        else:
+            out.write(str(item))
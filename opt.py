@@ -0,0 +1,348 @@
+from symbols import Symbols, ScopedEnv
+
+def to_int64(n):
+    # wrap like a 64 bit addq does
+    return (n + (1 << 63)) % (1 << 64) - (1 << 63)
+
+def bind_reads(exp, value_lst):
+    # the (read)s, in evaluation order, become the ints of value_lst. Reads
+    # past the end of value_lst are left to run
+    read_num = 0
+    work_lst = [("exp", exp)]
+    result_lst = []
+    while work_lst:
+        match work_lst.pop():
+            case ["exp", exp]:
+                match exp:
+                    case ["read"] if read_num < len(value_lst):
+                        result_lst.append(["int", to_int64(value_lst[read_num])])
+                        read_num += 1
+                    case ["+", arg1, arg2]:
+                        work_lst.append(("+",))
+                        work_lst.append(("exp", arg2))
+                        work_lst.append(("exp", arg1))
+                    case ["let", [var, value], let_exp]:
+                        work_lst.append(("let", var))
+                        work_lst.append(("exp", let_exp))
+                        work_lst.append(("exp", value))
+                    case _:
+                        result_lst.append(exp)
+            case ["+"]:
+                arg2 = result_lst.pop()
+                result_lst.append(["+", result_lst.pop(), arg2])
+            case ["let", var]:
+                let_exp = result_lst.pop()
+                result_lst.append(["let", [var, result_lst.pop()], let_exp])
+    if read_num < len(value_lst):
+        raise ValueError("Bind Err: {} values for {} reads".format(len(value_lst), read_num))
+    return result_lst.pop()
+
+def const_eval(exp):
+    # evaluates a program with no (read) straight from the parsed AST, with
+    # 64 bit wraparound. Returns None at the first (read), which is as far
+    # as the walk gets for programs that do read
+    env = ScopedEnv()
+    work_lst = [("exp", exp)]
+    value_lst = []
+    while work_lst:
+        match work_lst.pop():
+            case ["exp", exp]:
+                match exp:
+                    case ["int", i]:
+                        value_lst.append(i)
+                    case ["var", var]:
+                        value_lst.append(env.find(var))
+                    case ["read"]:
+                        return None
+                    case ["+", arg1, arg2]:
+                        work_lst.append(("+",))
+                        work_lst.append(("exp", arg2))
+                        work_lst.append(("exp", arg1))
+                    case ["let", [var, value], let_exp]:
+                        work_lst.append(("let", var, let_exp))
+                        work_lst.append(("exp", value))
+            case ["+"]:
+                arg2 = value_lst.pop()
+                value_lst.append(to_int64(value_lst.pop() + arg2))
+            case ["let", var, let_exp]:
+                env.bind(var, value_lst.pop())
+                work_lst.append(("unbind",))
+                work_lst.append(("exp", let_exp))
+            case ["unbind"]:
+                env.unbind()
+    return to_int64(value_lst.pop())
+
+def partial_eval(exp):
+    # runs between uniquify and flatten: folds + of ints, drops (+ 0 e),
+    # and substitutes let-bound constants. Variables are unique by now, so
+    # constants are kept in a list indexed by symbol id. (read) is never
+    # folded, so reads stay in their original order
+    const_lst = [None] * Symbols.symbol_num()
+    work_lst = [("exp", exp)]
+    result_lst = []
+    while work_lst:
+        match work_lst.pop():
+            case ["exp", exp]:
+                match exp:
+                    case ["var", var]:
+                        if const_lst[var] is not None:
+                            result_lst.append(["int", const_lst[var]])
+                        else:
+                            result_lst.append(exp)
+                    case ["int", _] | ["read"]:
+                        result_lst.append(exp)
+                    case ["+", arg1, arg2]:
+                        work_lst.append(("+",))
+                        work_lst.append(("exp", arg2))
+                        work_lst.append(("exp", arg1))
+                    case ["let", [var, value], let_exp]:
+                        work_lst.append(("let", var, let_exp))
+                        work_lst.append(("exp", value))
+            case ["+"]:
+                arg2 = result_lst.pop()
+                result_lst.append(fold_add(result_lst.pop(), arg2))
+            case ["let", var, let_exp]:
+                if result_lst[-1][0] == "int":
+                    const_lst[var] = result_lst.pop()[1]
+                    work_lst.append(("exp", let_exp))
+                else:
+                    work_lst.append(("bind", var))
+                    work_lst.append(("exp", let_exp))
+            case ["bind", var]:
+                let_exp = result_lst.pop()
+                value = result_lst.pop()
+                result_lst.append(["let", [var, value], let_exp])
+    return result_lst.pop()
+
+def fold_add(arg1, arg2):
+    if arg1[0] == "int" and arg2[0] == "int":
+        return ["int", to_int64(arg1[1] + arg2[1])]
+    elif arg1 == ["int", 0]:
+        return arg2
+    elif arg2 == ["int", 0]:
+        return arg1
+    return ["+", arg1, arg2]
+
+def uniquify_partial_eval(exp, env):
+    # uniquify and partial_eval in one walk, for --fused at -O1. env maps a
+    # source name to the atom its uses become, the let's constant or its
+    # renamed var. Every let still takes its symbol, after its value as in
+    # uniquify, so the result is the same as partial_eval(uniquify(exp))
+    work_lst = [("exp", exp)]
+    result_lst = []
+    while work_lst:
+        match work_lst.pop():
+            case ["exp", exp]:
+                match exp:
+                    case ["var", var]:
+                        result_lst.append(env.find(var))
+                    case ["int", _] | ["read"]:
+                        result_lst.append(exp)
+                    case ["+", arg1, arg2]:
+                        work_lst.append(("+",))
+                        work_lst.append(("exp", arg2))
+                        work_lst.append(("exp", arg1))
+                    case ["let", [var, value], let_exp]:
+                        work_lst.append(("let", var, let_exp))
+                        work_lst.append(("exp", value))
+            case ["+"]:
+                arg2 = result_lst.pop()
+                result_lst.append(fold_add(result_lst.pop(), arg2))
+            case ["let", var, let_exp]:
+                new_var = Symbols.get_new_symbol(var)
+                if result_lst[-1][0] == "int":
+                    env.bind(var, result_lst.pop())
+                    work_lst.append(("unbind",))
+                else:
+                    env.bind(var, ["var", new_var])
+                    work_lst.append(("bind", new_var))
+                work_lst.append(("exp", let_exp))
+            case ["unbind"]:
+                env.unbind()
+            case ["bind", new_var]:
+                env.unbind()
+                let_exp = result_lst.pop()
+                value = result_lst.pop()
+                result_lst.append(["let", [new_var, value], let_exp])
+    return result_lst.pop()
+
+def copy_propagate(bb):
+    # every var is assigned once in a flattened block and only used after
+    # that, so a copy of a var or an int can be dropped and its uses rewritten
+    copy_lst = [None] * Symbols.symbol_num()
+
+    def replace(arg):
+        if arg[0] == "var" and copy_lst[arg[1]] is not None:
+            return copy_lst[arg[1]]
+        return arg
+
+    old_inst_lst = bb.inst_lst
+    bb.inst_lst = []
+    for inst in old_inst_lst:
+        match inst:
+            case ["assign", ["var", var], ["var", _] | ["int", _]]:
+                copy_lst[var] = replace(inst[2])
+            case ["assign", dest, ["+", arg1, arg2]]:
+                bb.append(["assign", dest, ["+", replace(arg1), replace(arg2)]])
+            case ["assign", dest, src]:
+                bb.append(["assign", dest, replace(src)])
+            case _:
+                bb.append(inst)
+
+def dead_code_eliminate(bb):
+    # backward sweep dropping assigns to vars nobody reads. A dead read_int
+    # call still runs, as a bare ["call", func]
+    used_lst = [False] * Symbols.symbol_num()
+    new_inst_lst = []
+    for inst in reversed(bb.inst_lst):
+        match inst:
+            case ["assign", ["var", var], src] if not used_lst[var]:
+                if src[0] == "func":
+                    new_inst_lst.append(["call", src])
+                continue
+            case ["assign", _, ["+", arg1, arg2]]:
+                for arg in (arg1, arg2):
+                    if arg[0] == "var":
+                        used_lst[arg[1]] = True
+            case ["assign", _, ["var", var]]:
+                used_lst[var] = True
+        new_inst_lst.append(inst)
+    new_inst_lst.reverse()
+    bb.inst_lst = new_inst_lst
+
+def value_number(bb):
+    # local value numbering: a + whose operands (in either order) were
+    # already added is replaced by the first result. Vars are assigned once,
+    # so a var is its own value; read_int results never match anything
+    replace_lst = [None] * Symbols.symbol_num()
+    value_dict = {}
+
+    def replace(arg):
+        if arg[0] == "var" and replace_lst[arg[1]] is not None:
+            return replace_lst[arg[1]]
+        return arg
+
+    old_inst_lst = bb.inst_lst
+    bb.inst_lst = []
+    for inst in old_inst_lst:
+        match inst:
+            case ["assign", dest, ["+", arg1, arg2]]:
+                arg1 = replace(arg1)
+                arg2 = replace(arg2)
+                key1 = (arg1[0], arg1[1])
+                key2 = (arg2[0], arg2[1])
+                key = ("+", key1, key2) if key1 <= key2 else ("+", key2, key1)
+                if key not in value_dict:
+                    value_dict[key] = dest
+                    bb.append(["assign", dest, ["+", arg1, arg2]])
+                elif dest[0] == "var":
+                    replace_lst[dest[1]] = value_dict[key]
+                else:
+                    bb.append(["assign", dest, value_dict[key]])
+            case ["assign", dest, src]:
+                bb.append(["assign", dest, replace(src)])
+            case _:
+                bb.append(inst)
+
+def reassociate(bb, width=1):
+    # a + whose var is used once, by another +, is folded into that sum, so
+    # each remaining sum is n-ary over vars and ints. It is lowered again at
+    # its root: the ints merged into one constant, a var used k times built
+    # by doubling, and the terms added into width independent partial sums
+    # that are then added pairwise. Width 1 is one left deep chain, a wider
+    # sum is shorter but keeps width partial sums live. Reads are never
+    # moved, and every leaf var is assigned before the root, so the sum can
+    # be computed there. A sum is not folded across a read_int call, its
+    # leaves would all stay live over the call, and the partial sum is
+    # lowered where it was instead
+    use_lst = [0] * Symbols.symbol_num()
+    add_use_lst = [0] * Symbols.symbol_num()
+    sum_lst = [None] * Symbols.symbol_num()
+    call_num_lst = [0] * Symbols.symbol_num()    # calls before the sum
+    across_call_lst = [False] * Symbols.symbol_num()
+    call_num = 0
+    for inst in bb.inst_lst:
+        match inst:
+            case ["assign", dest, ["+", arg1, arg2]]:
+                for arg in (arg1, arg2):
+                    if arg[0] == "var":
+                        use_lst[arg[1]] += 1
+                        add_use_lst[arg[1]] += 1
+                        if call_num_lst[arg[1]] != call_num:
+                            across_call_lst[arg[1]] = True
+                if dest[0] == "var":
+                    sum_lst[dest[1]] = inst[2]
+                    call_num_lst[dest[1]] = call_num
+            case ["assign", _, ["var", var]]:
+                use_lst[var] += 1
+            case ["assign", _, ["func", _]] | ["call", _]:
+                call_num += 1
+
+    def is_inner(arg):
+        return arg[0] == "var" and sum_lst[arg[1]] is not None and use_lst[arg[1]] == add_use_lst[arg[1]] == 1 \
+            and not across_call_lst[arg[1]]
+
+    def times(var, k, term_lst):
+        # k * var by doubling, the bits of k from the top
+        term = ["var", var]
+        for bit in bin(k)[3:]:
+            tmp_var = ["var", Symbols.get_new_symbol("tmp")]
+            bb.append(["assign", tmp_var, ["+", term, term]])
+            term = tmp_var
+            if bit == "1":
+                tmp_var = ["var", Symbols.get_new_symbol("tmp")]
+                bb.append(["assign", tmp_var, ["+", term, ["var", var]]])
+                term = tmp_var
+        term_lst.append(term)
+
+    def lower(dest, term_lst):
+        # len(term_lst) - 1 adds, the last one into dest
+        if len(term_lst) == 1:
+            bb.append(["assign", dest, term_lst[0]])
+            return
+        add_num = len(term_lst) - 1
+        part_lst = term_lst[:width]
+        for i in range(len(part_lst), len(term_lst)):
+            add_num -= 1
+            sum_dest = dest if add_num == 0 else ["var", Symbols.get_new_symbol("tmp")]
+            bb.append(["assign", sum_dest, ["+", part_lst[i % width], term_lst[i]]])
+            part_lst[i % width] = sum_dest
+        while len(part_lst) > 1:
+            next_part_lst = []
+            for i in range(0, len(part_lst) - 1, 2):
+                add_num -= 1
+                sum_dest = dest if add_num == 0 else ["var", Symbols.get_new_symbol("tmp")]
+                bb.append(["assign", sum_dest, ["+", part_lst[i], part_lst[i + 1]]])
+                next_part_lst.append(sum_dest)
+            if len(part_lst) % 2 == 1:
+                next_part_lst.append(part_lst[-1])
+            part_lst = next_part_lst
+
+    old_inst_lst = bb.inst_lst
+    bb.inst_lst = []
+    for inst in old_inst_lst:
+        match inst:
+            case ["assign", dest, ["+", _, _]] if is_inner(dest):
+                continue
+            case ["assign", dest, ["+", arg1, arg2]]:
+                const = 0
+                count_dict = {}
+                arg_lst = [arg2, arg1]
+                while arg_lst:
+                    arg = arg_lst.pop()
+                    if is_inner(arg):
+                        arg_lst.append(sum_lst[arg[1]][2])
+                        arg_lst.append(sum_lst[arg[1]][1])
+                    elif arg[0] == "int":
+                        const += arg[1]
+                    else:
+                        count_dict[arg[1]] = count_dict.get(arg[1], 0) + 1
+                const = to_int64(const)
+                term_lst = []
+                for var in sorted(count_dict):
+                    times(var, count_dict[var], term_lst)
+                if const != 0 or not term_lst:
+                    term_lst.append(["int", const])
+                lower(dest, term_lst)
+            case _:
+                bb.append(inst)
@@ -0,0 +1,75 @@
+import sys
+
+from symbols import Symbols
+
+def write_exp(exp, out):
+    # writes the same text as str(exp) for nested lists and tuples, piece by
+    # piece into out, with no recursion and no intermediate strings.
+    # Symbol ids in ["var", id] and let bindings are written as "var.n"
+    work_lst = [(False, exp)]
+    while work_lst:
+        is_text, item = work_lst.pop()
+        if is_text:
+            out.write(item)
+            continue
+        match item:
+            case ["var", int(symbol)]:
+                if type(item) is list:
+                    out.write("['var', " + repr(Symbols.name(symbol)) + "]")
+                else:
+                    out.write("('var', " + repr(Symbols.name(symbol)) + ")")
+            case ["let", [int(symbol), value], let_exp] if type(item) is list and type(item[1]) is list:
+                out.write("['let', [" + repr(Symbols.name(symbol)) + ", ")
+                work_lst.append((True, "]"))
+                work_lst.append((False, let_exp))
+                work_lst.append((True, "], "))
+                work_lst.append((False, value))
+            case list() | tuple():
+                if type(item) is list:
+                    out.write("[")
+                    work_lst.append((True, "]"))
+                elif len(item) == 1:
+                    out.write("(")
+                    work_lst.append((True, ",)"))
+                else:
+                    out.write("(")
+                    work_lst.append((True, ")"))
+                for i in range(len(item) - 1, -1, -1):
+                    work_lst.append((False, item[i]))
+                    if i > 0:
+                        work_lst.append((True, ", "))
+            case _:
+                out.write(repr(item))
+
+def write_line(obj, out):
+    if isinstance(obj, str):
+        out.write(obj)
+    elif hasattr(obj, "write"):
+        obj.write(out)
+    else:
+        write_exp(obj, out)
+    out.write("\n")
+
+DUMP_PASSES = ("parse", "bind_reads", "const_eval", "uniquify", "partial_eval", "flatten", "to_ssa", "from_ssa", "copy_propagate",
+               "reassociate", "value_number", "dead_code_eliminate", "select_instruction", "interference", "reg_alloc", "assign_home", "patch_instruction",
+               "superopt")
+
+class Dumper:
+    # level 0 dumps nothing, 1 the pass headers, 2 the headers and the IR.
+    # The IR is only formatted once a dump is enabled, so a disabled dump
+    # costs one comparison
+
+    def __init__(self, level=0, pass_set=None, out=None):
+        self.level = level
+        self.pass_set = pass_set
+        self.out = out if out is not None else sys.stderr
+
+    def dump(self, pass_name, header, obj):
+        if self.level == 0:
+            return
+        if self.pass_set is not None and pass_name not in self.pass_set:
+            return
+        if header is not None:
+            write_line(header, self.out)
+        if self.level >= 2:
+            write_line(obj, self.out)
@@ -0,0 +1,101 @@
+import mmap
+import re
+import sys
+
+TOKEN_RE = re.compile(rb"[()]|[^\s()]+")
+STR_TOKEN_RE = re.compile(r"[()]|[^\s()]+")
+CHUNK_SIZE = 1 << 16
+
+def open_source(path=None):
+    # map the file (or a stdin redirected from a file) instead of reading it,
+    # pipes and ttys can't be mapped so they are read chunk by chunk. The map
+    # keeps its own handle, so a file is closed at once or when the chunks run out
+    if not path:
+        try:
+            return mmap.mmap(sys.stdin.buffer.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):    # empty, pipe or tty
+            return iter(lambda: sys.stdin.buffer.read(CHUNK_SIZE), b"")
+    f = open(path, "rb")
+    try:
+        source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):    # empty file or named pipe
+        return read_chunks(f)
+    f.close()
+    return source
+
+def read_chunks(f):
+    with f:
+        yield from iter(lambda: f.read(CHUNK_SIZE), b"")
+
+def scan_chunks(chunks):
+    # only a token the chunk may have cut off is carried over, so whitespace
+    # runs are dropped as they go and a chunk is joined to a short tail
+    base = 0
+    rest = b""
+    for chunk in chunks:
+        buf = rest + chunk if rest else chunk
+        keep = len(buf)
+        for m in TOKEN_RE.finditer(buf):
+            if m.end() == len(buf) and buf[m.start()] not in b"()":
+                keep = m.start()
+                break    # atom may go on in the next chunk
+            yield m.group().decode(), base + m.start()
+        rest = buf[keep:]
+        base += keep
+    for m in TOKEN_RE.finditer(rest):
+        yield m.group().decode(), base + m.start()
+
+def scan(code):
+    # yields (token, offset) lazily, offset is in bytes for bytes/mmap input
+    if isinstance(code, str):
+        for m in STR_TOKEN_RE.finditer(code):
+            yield m.group(), m.start()
+    elif isinstance(code, (bytes, bytearray, mmap.mmap)):
+        for m in TOKEN_RE.finditer(code):
+            yield m.group().decode(), m.start()
+    else:
+        yield from scan_chunks(code)
+
+class Scanner:
+
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.lookahead = next(self.tokens, None)
+        self.pos = 0    # offset of the last token taken
+
+    def peek(self):
+        if self.lookahead is None:
+            raise SyntaxError("Parse Err: Unexpected EOF")
+        return self.lookahead[0]
+
+    def next(self):
+        token = self.peek()
+        self.pos = self.lookahead[1]
+        self.lookahead = next(self.tokens, None)
+        return token
+
+def parse(tokens, table=None):
+    # table: a HashCons to share structurally identical nodes
+    scanner = Scanner(tokens)
+    stack = []    # open lists still waiting for their ')'
+    while True:
+        token = scanner.next()
+        if token == '(':
+            stack.append([scanner.next()])    # op
+            continue
+        elif token == ')':
+            if len(stack) == 0:
+                raise SyntaxError('Parse Err: Unexpected ) at {}'.format(scanner.pos))
+            exp = stack.pop()
+        elif token[0].isdigit() or token[0] == "-":
+            try:
+                exp = ["int", int(token)]
+            except ValueError:
+                raise SyntaxError('Parse Err: Bad number {} at {}'.format(token, scanner.pos))
+        else:
+            exp = ["var", token]
+        if table is not None:
+            exp = table.node(exp)
+        if len(stack) == 0:
+            return exp
+        stack[-1].append(exp)
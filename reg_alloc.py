@@ -0,0 +1,662 @@
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+
+from symbols import Symbols
+
+# rsp and rbp hold the frame, rax is the result and read_int's, and rax and
+# r11 are patch_instruction's scratch. The caller saved ones come first, as
+# only the callee saved ones have to be pushed
+CALLER_SAVED_REG_LST = ["rcx", "rdx", "rsi", "rdi", "r8", "r9", "r10"]
+CALLEE_SAVED_REG_LST = ["rbx", "r12", "r13", "r14", "r15"]
+REG_LST = CALLER_SAVED_REG_LST + CALLEE_SAVED_REG_LST
+
+# the set bits of a byte
+BYTE_BIT_LST = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+def set_bits(data, bit_num):
+    # the bit_num set bits of little endian bytes, a whole number of 64 bit
+    # words. A byte at a time when most bytes have one, else a word at a time
+    if bit_num * 8 >= len(data):
+        return [8 * i + bit for i, byte in enumerate(bytes(data)) if byte for bit in BYTE_BIT_LST[byte]]
+    bit_lst = []
+    word_lst = memoryview(data).cast("Q")
+    for i in range(len(word_lst)):
+        word = word_lst[i]
+        while word:
+            low = word & -word
+            bit_lst.append(64 * i + low.bit_length() - 1)
+            word ^= low
+    return bit_lst
+
+class InterferenceGraph:
+    # the interference graph of the vars of a selected block. Nodes are
+    # numbered densely, the vars in the order they are defined and then the
+    # precolored registers of reg_lst: node_lst maps a symbol id to its node,
+    # var_lst a var node back and reg_node_dict a register to its node.
+    # Adjacency is a bit matrix, a row of 64 bit words per node, when that is
+    # smaller than adjacency lists, and CSR arrays with an edge set
+    # otherwise, so an edge check is O(1) either way. cost_lst counts the
+    # uses and defs of a node, what spilling it costs, call_lst marks the
+    # nodes live across a callq, and move_lst has the (src, dest) nodes of
+    # every movq between two of them. merge coalesces two nodes in place;
+    # CSR rows it changes move to adj_set_dict
+
+    def __init__(self, var_lst, reg_lst, dense):
+        self.var_lst = var_lst
+        self.reg_lst = reg_lst
+        node_num = len(var_lst) + len(reg_lst)
+        self.node_lst = array("q", [-1]) * Symbols.symbol_num()
+        for node in range(len(var_lst)):
+            self.node_lst[var_lst[node]] = node
+        self.reg_node_dict = {reg_lst[i]: len(var_lst) + i for i in range(len(reg_lst))}
+        self.degree_lst = array("q", [0]) * node_num
+        self.cost_lst = array("q", [0]) * node_num
+        self.call_lst = bytearray(node_num)
+        self.move_lst = []
+        self.row_bytes = (node_num + 63) // 64 * 8
+        self.matrix = bytearray(node_num * self.row_bytes) if dense else None
+        self.adj_start_lst = None
+        self.adj_node_lst = None
+        self.adj_set_dict = {}
+        self.edge_set = None
+
+    def __len__(self):
+        return len(self.degree_lst)
+
+    def is_precolored(self, node):
+        return node >= len(self.var_lst)
+
+    def name(self, node):
+        if self.is_precolored(node):
+            return "%" + self.reg_lst[node - len(self.var_lst)]
+        return Symbols.name(self.var_lst[node])
+
+    def set_row(self, node, row):
+        start = node * self.row_bytes
+        self.matrix[start:start + self.row_bytes] = row.to_bytes(self.row_bytes, "little")
+        self.degree_lst[node] = row.bit_count()
+
+    def set_adj(self, adj_lst):
+        # packs neighbour sets into the CSR arrays
+        self.adj_start_lst = array("q", [0]) * (len(adj_lst) + 1)
+        self.adj_node_lst = array("q")
+        for node in range(len(adj_lst)):
+            self.adj_node_lst.extend(sorted(adj_lst[node]))
+            self.adj_start_lst[node + 1] = len(self.adj_node_lst)
+            self.degree_lst[node] = len(adj_lst[node])
+
+    def interferes(self, node1, node2):
+        if self.matrix is not None:
+            return self.matrix[node1 * self.row_bytes + (node2 >> 3)] >> (node2 & 7) & 1 == 1
+        if node1 in self.adj_set_dict:
+            return node2 in self.adj_set_dict[node1]
+        if self.edge_set is None:
+            # made on the first check, coloring alone never needs it
+            node_num = len(self)
+            self.edge_set = set()
+            for node in range(node_num):
+                self.edge_set.update(node * node_num + adj_node for adj_node in self.neighbors(node))
+        return node1 * len(self) + node2 in self.edge_set
+
+    def row(self, node):
+        # the bit matrix row of node as an int
+        start = node * self.row_bytes
+        return int.from_bytes(self.matrix[start:start + self.row_bytes], "little")
+
+    def neighbors(self, node):
+        if self.matrix is not None:
+            start = node * self.row_bytes
+            return set_bits(memoryview(self.matrix)[start:start + self.row_bytes], self.degree_lst[node])
+        if node in self.adj_set_dict:
+            return self.adj_set_dict[node]
+        return self.adj_node_lst[self.adj_start_lst[node]:self.adj_start_lst[node + 1]]
+
+    def merge(self, keep, gone):
+        # keep takes over the edges, uses and calls of gone, which is left
+        # with none. A neighbour of both loses one edge
+        self.cost_lst[keep] += self.cost_lst[gone]
+        self.cost_lst[gone] = 0
+        self.call_lst[keep] |= self.call_lst[gone]
+        self.call_lst[gone] = 0
+        if self.matrix is not None:
+            keep_row = self.row(keep)
+            gone_row = self.row(gone)
+            for node in set_bits(gone_row.to_bytes(self.row_bytes, "little"), gone_row.bit_count()):
+                start = node * self.row_bytes
+                self.matrix[start + (gone >> 3)] &= ~(1 << (gone & 7))
+                if keep_row >> node & 1:
+                    self.degree_lst[node] -= 1
+                else:
+                    self.matrix[start + (keep >> 3)] |= 1 << (keep & 7)
+            self.set_row(keep, keep_row | gone_row)
+            self.set_row(gone, 0)
+            return
+        keep_set = self.adj_set(keep)
+        for node in self.neighbors(gone):
+            adj_set = self.adj_set(node)
+            adj_set.discard(gone)
+            if node in keep_set:
+                self.degree_lst[node] -= 1
+            else:
+                adj_set.add(keep)
+                keep_set.add(node)
+        self.adj_set_dict[gone] = set()
+        self.degree_lst[keep] = len(keep_set)
+        self.degree_lst[gone] = 0
+
+    def adj_set(self, node):
+        # the neighbours of node as a set merge can change
+        if node not in self.adj_set_dict:
+            self.adj_set_dict[node] = set(self.neighbors(node))
+        return self.adj_set_dict[node]
+
+    def write(self, out):
+        out.write("interference\n")
+        for node in range(len(self)):
+            out.write("\t" + self.name(node) + ":")
+            for adj_node in self.neighbors(node):
+                out.write(" " + self.name(adj_node))
+            out.write("\n")
+
+def uncover_live(inst_lst):
+    # a forward pass numbers the vars in def order and finds their last
+    # uses, then one backward sweep adds the edges with old/r1.py's rules:
+    # the dest of a movq interferes with every var live after it but its
+    # src, the dest of an addq with all of them. rax is a precolored node,
+    # defined by callq and by the moves into it, live from the end of the
+    # block and from a callq to the movq that takes its result
+    node_lst = array("q", [-1]) * Symbols.symbol_num()
+    var_lst = []
+    def_pos_lst = array("q")
+    end_lst = array("q")
+    cost_lst = []
+    move_lst = []
+    # every var defined before it is used, by one movq or a movq and the
+    # addq right after it, as select_instruction leaves them
+    is_ssa = True
+    for i in range(len(inst_lst)):
+        match inst_lst[i]:
+            case [op, src, dest]:
+                for arg in (src, dest):
+                    if arg[0] != "var":
+                        continue
+                    node = node_lst[arg[1]]
+                    if node < 0:
+                        node = len(var_lst)
+                        node_lst[arg[1]] = node
+                        var_lst.append(arg[1])
+                        def_pos_lst.append(i)
+                        end_lst.append(i)
+                        cost_lst.append(0)
+                        if arg is src or op == "addq":
+                            is_ssa = False
+                    elif arg is dest and (op == "movq" or def_pos_lst[node] != i - 1):
+                        is_ssa = False
+                    if arg is src or op == "addq":
+                        end_lst[node] = i
+                    cost_lst[node] += 1
+                if op == "movq" and src[0] in ("var", "reg") and dest[0] in ("var", "reg"):
+                    # -1 for rax, which is numbered after the vars
+                    move_lst.append((node_lst[src[1]] if src[0] == "var" else -1,
+                                     node_lst[dest[1]] if dest[0] == "var" else -1))
+
+    # the bit matrix takes node_num ** 2 / 8 bytes, the CSR arrays and edge
+    # set some 64 per edge, and walking a row takes node_num / 64 words
+    # against the degree of the node. It is used from an average degree of
+    # node_num / 64 up. The edges are about the vars live at each def
+    node_num = len(var_lst) + 1
+    live_num_lst = array("q", [0]) * (len(inst_lst) + 1)
+    for node in range(len(var_lst)):
+        if end_lst[node] > def_pos_lst[node]:
+            live_num_lst[def_pos_lst[node]] += 1
+            live_num_lst[end_lst[node]] -= 1
+    live_num = 0
+    edge_num = 0
+    for i in range(len(inst_lst)):
+        live_num += live_num_lst[i]
+        live_num_lst[i] = live_num
+    for node in range(len(var_lst)):
+        edge_num += live_num_lst[def_pos_lst[node]]
+    graph = InterferenceGraph(var_lst, ["rax"], is_ssa and node_num * node_num <= 128 * edge_num)
+    rax_node = graph.reg_node_dict["rax"]
+    graph.cost_lst[:len(var_lst)] = array("q", cost_lst)
+    graph.move_lst = [(rax_node if src_node < 0 else src_node, rax_node if dest_node < 0 else dest_node)
+                      for src_node, dest_node in move_lst]
+    if graph.matrix is not None:
+        dense_interfere(graph, inst_lst, def_pos_lst, end_lst)
+    else:
+        sparse_interfere(graph, inst_lst)
+    return graph
+
+def dense_interfere(graph, inst_lst, def_pos_lst, end_lst):
+    # the live set is an int bitset, so a def takes the whole of it into its
+    # row at once. That gives each var the earlier defined vars it
+    # interferes with; the later ones are the vars defined while it is
+    # live, a range of node ids, but the movqs from it that added no edge.
+    # rax is never in the live set, its row is kept whole during the sweep
+    node_lst = graph.node_lst
+    rax_node = graph.reg_node_dict["rax"]
+    row_lst = [0] * len(graph.var_lst)
+    live_bits = 0
+    call_bits = 0
+    rax_bits = 0
+    rax_live = True
+    for inst in reversed(inst_lst):
+        match inst:
+            case ["callq", _]:
+                call_bits |= live_bits
+                rax_bits |= live_bits
+                rax_live = False
+            case [op, src, dest]:
+                src_node = node_lst[src[1]] if src[0] == "var" else -1
+                src_bits = ~(1 << src_node) if op == "movq" and src_node >= 0 else -1
+                if dest[0] == "var":
+                    dest_node = node_lst[dest[1]]
+                    row_lst[dest_node] |= live_bits & src_bits
+                    if op == "movq":
+                        live_bits &= ~(1 << dest_node)
+                    else:
+                        live_bits |= 1 << dest_node
+                    if rax_live and not (op == "movq" and src[0] == "reg"):
+                        rax_bits |= 1 << dest_node
+                else:
+                    rax_bits |= live_bits & src_bits
+                    rax_live = op == "addq"
+                if src_node >= 0:
+                    live_bits |= 1 << src_node
+                elif src[0] == "reg":
+                    rax_live = True
+    exempt_lst = [[] for _ in range(len(graph.var_lst))]
+    for src_node, dest_node in graph.move_lst:
+        if src_node != rax_node and dest_node != rax_node and not row_lst[dest_node] >> src_node & 1:
+            exempt_lst[src_node].append(dest_node)
+    for node in range(len(graph.var_lst)):
+        high = bisect_left(def_pos_lst, end_lst[node])
+        row = row_lst[node] & ~(1 << node)
+        if high > node + 1:
+            row |= ((1 << high) - 1) >> (node + 1) << (node + 1)
+        for dest_node in exempt_lst[node]:
+            row &= ~(1 << dest_node)
+        if rax_bits >> node & 1:
+            row |= 1 << rax_node
+        row_lst[node] = None
+        graph.set_row(node, row)
+    graph.set_row(rax_node, rax_bits)
+    for node in set_bits(call_bits.to_bytes(graph.row_bytes, "little"), call_bits.bit_count()):
+        graph.call_lst[node] = 1
+
+def sparse_interfere(graph, inst_lst):
+    node_lst = graph.node_lst
+    rax_node = graph.reg_node_dict["rax"]
+    adj_lst = [set() for _ in range(len(graph))]
+    live_set = set()
+    # rax is live from the end of the block
+    live_set.add(rax_node)
+    for inst in reversed(inst_lst):
+        match inst:
+            case ["callq", _]:
+                live_set.discard(rax_node)
+                for node in live_set:
+                    graph.call_lst[node] = 1
+                    adj_lst[rax_node].add(node)
+                    adj_lst[node].add(rax_node)
+            case [op, src, dest]:
+                src_node = node_lst[src[1]] if src[0] == "var" else rax_node if src[0] == "reg" else -1
+                dest_node = node_lst[dest[1]] if dest[0] == "var" else rax_node
+                for node in live_set:
+                    if node != dest_node and (op != "movq" or node != src_node):
+                        adj_lst[dest_node].add(node)
+                        adj_lst[node].add(dest_node)
+                if op == "movq":
+                    live_set.discard(dest_node)
+                else:
+                    live_set.add(dest_node)
+                if src_node >= 0:
+                    live_set.add(src_node)
+    graph.set_adj(adj_lst)
+
+class RegFrame:
+    # the homes the allocator picked, with the get_var_pos and get_frame_size
+    # of let_lan.py's StackFrame. Spill slots sit below the pushed callee
+    # saved registers
+
+    def __init__(self, var_num):
+        self.reg_lst = [None] * var_num
+        self.slot_lst = array("q", [-1]) * var_num
+        self.saved_reg_lst = []
+        self.frame_len = 0
+        self.spill_num = 0
+
+    def get_var_pos(self, arg):
+        if arg[0] != "var":
+            return arg
+        var = arg[1]
+        if self.reg_lst[var] is not None:
+            return ["reg", self.reg_lst[var]]
+        return ("deref", "rbp", -8 * (len(self.saved_reg_lst) + self.slot_lst[var] + 1))
+
+    def get_frame_size(self):
+        # rsp is 16 byte aligned after pushq %rbp, and stays so at the
+        # callqs once the pushes and the slots are an even number
+        frame_size = self.frame_len
+        if (len(self.saved_reg_lst) + frame_size) % 2 == 1:
+            frame_size += 1
+        return frame_size * 8
+
+    def save_callee_saved(self):
+        used_reg_set = set(self.reg_lst)
+        self.saved_reg_lst = [reg for reg in CALLEE_SAVED_REG_LST if reg in used_reg_set]
+
+    def write(self, out):
+        out.write("homes\n")
+        for var in range(len(self.reg_lst)):
+            if self.reg_lst[var] is not None:
+                out.write("\t" + Symbols.name(var) + " -> %" + self.reg_lst[var] + "\n")
+            elif self.slot_lst[var] >= 0:
+                out.write("\t" + Symbols.name(var) + " -> slot " + str(self.slot_lst[var]) + "\n")
+
+def coalesce(graph, k, call_k):
+    # conservative coalescing, in one pass over the moves: two vars that do
+    # not interfere are merged when Briggs' test says the merged node has
+    # fewer than k neighbours of k or more degree, so a graph simplify could
+    # empty stays so. A var goes into precolored rax whenever they do not
+    # interfere, George's test for it always holds as rax is none of the k
+    # registers. George's test between two vars would also merge a var that
+    # gets a register into one that spills. A node live across a callq has
+    # call_k registers, the others k. Returns the node each node was merged
+    # into, itself if none
+    var_num = len(graph.var_lst)
+    alias_lst = array("q", range(len(graph)))
+
+    def node_k(node):
+        return call_k if graph.call_lst[node] else k
+
+    def find(node):
+        while alias_lst[node] != node:
+            node = alias_lst[node]
+        return node
+
+    def colored_degree(node):
+        # the registers coloring has to keep from node's neighbours, the
+        # precolored ones are not among them
+        return graph.degree_lst[node] - sum(graph.interferes(node, reg_node) for reg_node in graph.reg_node_dict.values())
+
+    degree_lst = array("q", map(colored_degree, range(len(graph))))
+
+    def adj_bits(node):
+        # the neighbours of node that are colored, as an int with the bit
+        # matrix and as a list otherwise
+        if graph.matrix is not None:
+            return graph.row(node) & var_mask
+        return [adj_node for adj_node in graph.neighbors(node) if adj_node < var_num]
+
+    def bit_nodes(bits):
+        # the nodes of an int adj_bits, low to high, so a test can stop early
+        while bits:
+            low = bits & -bits
+            bits ^= low
+            yield low.bit_length() - 1
+
+    def briggs(node1, node2, merged_k):
+        if degree_lst[node1] + degree_lst[node2] < merged_k:
+            return True
+        adj1 = adj_bits(node1)
+        adj2 = adj_bits(node2)
+        if type(adj1) is int:
+            both = adj1 & adj2
+            adj_lst = bit_nodes(adj1 | adj2)
+        else:
+            both = set(adj1) & set(adj2)
+            adj_lst = both.union(adj1, adj2)
+        high_num = 0
+        for adj_node in adj_lst:
+            # a neighbour of both loses an edge
+            lost = both >> adj_node & 1 if type(both) is int else adj_node in both
+            if degree_lst[adj_node] - lost >= node_k(adj_node):
+                high_num += 1
+                if high_num >= merged_k:
+                    return False
+        return True
+
+    var_mask = (1 << var_num) - 1
+    # a merge only adds neighbours to the merged node, which Briggs' test
+    # likes less, but a move to rax always goes. So the moves of a node
+    # merged into rax are tried again, the others once
+    move_lst = graph.move_lst
+    node_move_lst = [[] for _ in range(len(graph))]
+    for move in range(len(move_lst)):
+        for node in move_lst[move]:
+            node_move_lst[node].append(move)
+    work_lst = list(range(len(move_lst) - 1, -1, -1))
+    in_work_lst = bytearray(b"\x01") * len(move_lst)
+    while work_lst:
+        move = work_lst.pop()
+        in_work_lst[move] = 0
+        node1 = find(move_lst[move][0])
+        node2 = find(move_lst[move][1])
+        if node1 == node2 or node1 >= var_num and node2 >= var_num or graph.interferes(node1, node2):
+            continue
+        # the precolored node stays, else the one with more neighbours
+        if node2 >= var_num or node1 < var_num and degree_lst[node2] > degree_lst[node1]:
+            node1, node2 = node2, node1
+        if node1 < var_num and not briggs(node1, node2, min(node_k(node1), node_k(node2))):
+            continue
+        # a neighbour of both loses an edge, one of node2 only swaps it for
+        # one to node1, which does not count if node1 is precolored
+        for node in graph.neighbors(node2):
+            if node < var_num and (node1 >= var_num or graph.interferes(node1, node)):
+                degree_lst[node] -= 1
+        graph.merge(node1, node2)
+        degree_lst[node1] = colored_degree(node1)
+        degree_lst[node2] = 0
+        alias_lst[node2] = node1
+        if node1 >= var_num:
+            for other_move in node_move_lst[node2]:
+                if not in_work_lst[other_move]:
+                    work_lst.append(other_move)
+                    in_work_lst[other_move] = 1
+        else:
+            if len(node_move_lst[node1]) < len(node_move_lst[node2]):
+                node_move_lst[node1], node_move_lst[node2] = node_move_lst[node2], node_move_lst[node1]
+            node_move_lst[node1] += node_move_lst[node2]
+        node_move_lst[node2] = []
+    for node in range(len(graph)):
+        alias_lst[node] = find(node)
+    return alias_lst
+
+def color_graph(graph, reg_lst=REG_LST, coalesce_move=True):
+    # Chaitin-Briggs after coalescing: simplify takes out a node with fewer
+    # neighbours left than registers it may have, which will always get
+    # one, and when there is none the node with the least cost per
+    # neighbour, optimistically. select puts them back in reverse, each
+    # taking the first register no neighbour has, and only a node left
+    # without one is spilled. Spilled nodes get stack slots the same way,
+    # with as many slots as it takes. With the bit matrix, select keeps the
+    # nodes of each register as a bitset and checks a whole row against it.
+    # Precolored nodes, and the nodes merged into others, are never colored
+    callee_saved_lst = [reg for reg in reg_lst if reg in CALLEE_SAVED_REG_LST]
+    if coalesce_move:
+        alias_lst = coalesce(graph, len(reg_lst), len(callee_saved_lst))
+    else:
+        alias_lst = array("q", range(len(graph)))
+    k_lst = bytes(len(callee_saved_lst) if graph.call_lst[node] else len(reg_lst) for node in range(len(graph)))
+
+    def spill_priority(node):
+        return graph.cost_lst[node] / (degree_lst[node] + 1)
+
+    degree_lst = array("q", graph.degree_lst)
+    removed_lst = bytearray(len(graph))
+    for node in range(len(graph)):
+        if graph.is_precolored(node):
+            removed_lst[node] = 1
+            for adj_node in graph.neighbors(node):
+                degree_lst[adj_node] -= 1
+        elif alias_lst[node] != node:
+            removed_lst[node] = 1
+    node_num = len(graph) - sum(removed_lst)
+
+    low_lst = []
+    in_low_lst = bytearray(len(graph))
+    spill_heap = []
+    for node in range(len(graph)):
+        if removed_lst[node]:
+            continue
+        if degree_lst[node] < k_lst[node]:
+            low_lst.append(node)
+            in_low_lst[node] = 1
+        else:
+            spill_heap.append((spill_priority(node), node))
+    heapq.heapify(spill_heap)
+
+    select_lst = []
+    while len(select_lst) < node_num:
+        if low_lst:
+            node = low_lst.pop()
+        else:
+            _, node = heapq.heappop(spill_heap)
+            if removed_lst[node]:
+                continue
+            # degrees only go down, so a stale priority is too low and the
+            # key of every other node is at most its priority. node is still
+            # the least while it is no more than the next key
+            if spill_heap and spill_priority(node) > spill_heap[0][0]:
+                heapq.heappush(spill_heap, (spill_priority(node), node))
+                continue
+        removed_lst[node] = 1
+        select_lst.append(node)
+        for adj_node in graph.neighbors(node):
+            if not removed_lst[adj_node]:
+                degree_lst[adj_node] -= 1
+                if degree_lst[adj_node] < k_lst[adj_node] and not in_low_lst[adj_node]:
+                    low_lst.append(adj_node)
+                    in_low_lst[adj_node] = 1
+
+    def used_homes(node, home_lst, home_bits_lst):
+        if graph.matrix is not None:
+            row = graph.row(node)
+            return {home for home in range(len(home_bits_lst)) if row & home_bits_lst[home]}
+        return {home_lst[adj_node] for adj_node in graph.neighbors(node)}
+
+    # homes are indexes into reg_lst, then slots
+    home_lst = array("q", [-1]) * len(graph)
+    home_bits_lst = [0] * len(reg_lst)
+    spill_lst = []
+    while select_lst:
+        node = select_lst.pop()
+        used_set = used_homes(node, home_lst, home_bits_lst)
+        for home in range(len(reg_lst)):
+            if home not in used_set and (not graph.call_lst[node] or reg_lst[home] in CALLEE_SAVED_REG_LST):
+                home_lst[node] = home
+                home_bits_lst[home] |= 1 << node
+                break
+        else:
+            spill_lst.append(node)
+
+    sf = RegFrame(Symbols.symbol_num())
+    for node in range(len(graph.var_lst)):
+        home_node = alias_lst[node]
+        if graph.is_precolored(home_node):
+            sf.reg_lst[graph.var_lst[node]] = graph.reg_lst[home_node - len(graph.var_lst)]
+        elif home_lst[home_node] >= 0:
+            sf.reg_lst[graph.var_lst[node]] = reg_lst[home_lst[home_node]]
+    home_lst = array("q", [-1]) * len(graph)
+    home_bits_lst = []
+    for node in spill_lst:
+        used_set = used_homes(node, home_lst, home_bits_lst)
+        slot = 0
+        while slot in used_set:
+            slot += 1
+        if slot == len(home_bits_lst):
+            home_bits_lst.append(0)
+        home_lst[node] = slot
+        home_bits_lst[slot] |= 1 << node
+    for node in range(len(graph.var_lst)):
+        home_node = alias_lst[node]
+        if home_lst[home_node] >= 0:
+            sf.slot_lst[graph.var_lst[node]] = home_lst[home_node]
+    sf.frame_len = len(home_bits_lst)
+    sf.spill_num = len(spill_lst)
+    sf.save_callee_saved()
+    return sf
+
+def live_intervals(inst_lst):
+    # instruction i reads its operands at 2 * i and writes its dest at
+    # 2 * i + 1, so a movq src can end where its dest starts and share its
+    # register. A var lives from its def to its last use, as every var is
+    # assigned before it is used. Also returns where the callqs clobber
+    var_num = Symbols.symbol_num()
+    start_lst = array("q", [-1]) * var_num
+    end_lst = array("q", [-1]) * var_num
+    call_pos_lst = []
+    for i in range(len(inst_lst)):
+        match inst_lst[i]:
+            case ["callq", _]:
+                call_pos_lst.append(2 * i + 1)
+            case [_, src, dest]:
+                if src[0] == "var":
+                    end_lst[src[1]] = 2 * i
+                if dest[0] == "var":
+                    var = dest[1]
+                    if start_lst[var] < 0:
+                        start_lst[var] = 2 * i + 1
+                    end_lst[var] = max(end_lst[var], 2 * i + 1)
+    return start_lst, end_lst, call_pos_lst
+
+def linear_scan(inst_lst, reg_lst=REG_LST):
+    # Poletto and Sarkar: one sweep over the intervals sorted by start,
+    # keeping the active ones in a heap by end. An interval over a callq may
+    # only take a callee saved register. When none is free, whichever of it
+    # and the active intervals it could take a register from ends last is
+    # spilled. Spilled intervals then get stack slots in a second sweep
+    start_lst, end_lst, call_pos_lst = live_intervals(inst_lst)
+    var_lst = sorted((var for var in range(len(start_lst)) if start_lst[var] >= 0), key=start_lst.__getitem__)
+    callee_saved_lst = [reg for reg in reg_lst if reg in CALLEE_SAVED_REG_LST]
+    sf = RegFrame(len(start_lst))
+    # the var holding each register, the heap may still have spilled vars
+    reg_var_dict = {}
+    active_heap = []
+    spill_lst = []
+    for var in var_lst:
+        start = start_lst[var]
+        while active_heap and active_heap[0][0] < start:
+            _, active_var = heapq.heappop(active_heap)
+            if sf.reg_lst[active_var] is not None:
+                del reg_var_dict[sf.reg_lst[active_var]]
+        call_index = bisect_right(call_pos_lst, start)
+        crosses_call = call_index < len(call_pos_lst) and call_pos_lst[call_index] < end_lst[var]
+        allowed_lst = callee_saved_lst if crosses_call else reg_lst
+        victim = -1
+        for reg in allowed_lst:
+            if reg not in reg_var_dict:
+                sf.reg_lst[var] = reg
+                break
+            if victim < 0 or end_lst[reg_var_dict[reg]] > end_lst[victim]:
+                victim = reg_var_dict[reg]
+        else:
+            if victim >= 0 and end_lst[victim] > end_lst[var]:
+                sf.reg_lst[var] = sf.reg_lst[victim]
+                sf.reg_lst[victim] = None
+                spill_lst.append(victim)
+            else:
+                spill_lst.append(var)
+                continue
+        reg_var_dict[sf.reg_lst[var]] = var
+        heapq.heappush(active_heap, (end_lst[var], var))
+
+    spill_lst.sort(key=start_lst.__getitem__)
+    free_slot_heap = []
+    slot_heap = []
+    for var in spill_lst:
+        while slot_heap and slot_heap[0][0] < start_lst[var]:
+            heapq.heappush(free_slot_heap, heapq.heappop(slot_heap)[1])
+        if free_slot_heap:
+            slot = heapq.heappop(free_slot_heap)
+        else:
+            slot = sf.frame_len
+            sf.frame_len += 1
+        sf.slot_lst[var] = slot
+        heapq.heappush(slot_heap, (end_lst[var], slot))
+    sf.spill_num = len(spill_lst)
+    sf.save_callee_saved()
+    return sf
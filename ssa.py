@@ -0,0 +1,175 @@
+from array import array
+
+from symbols import Symbols
+
+# A block in SSA form: every value is defined once and its id is its place
+# in the block, so a value is always defined before its uses. Ints are
+# values too, one per constant, and are never placed.
+#   INT   arg1 = the int
+#   READ  a read_int call
+#   ADD   arg1 + arg2, both value ids
+#   NOP   a removed value
+INT, READ, ADD, NOP = range(4)
+
+class SSA:
+
+    def __init__(self):
+        self.kind = array("B")
+        self.arg1 = array("q")
+        self.arg2 = array("q")
+        # def-use chains, the ids of the values using each value
+        self.use_lst = []
+        # the var or reg each value was first assigned to, None for ints
+        self.name_lst = []
+        self.const_dict = {}
+        self.result = -1
+
+    def __len__(self):
+        return len(self.kind)
+
+    def new_value(self, kind, arg1=0, arg2=0, name=None):
+        value = len(self.kind)
+        self.kind.append(kind)
+        self.arg1.append(arg1)
+        self.arg2.append(arg2)
+        self.use_lst.append([])
+        self.name_lst.append(name)
+        if kind == ADD:
+            self.use_lst[arg1].append(value)
+            self.use_lst[arg2].append(value)
+        return value
+
+    def const(self, i):
+        if i not in self.const_dict:
+            self.const_dict[i] = self.new_value(INT, i)
+        return self.const_dict[i]
+
+    def is_used(self, value):
+        return len(self.use_lst[value]) > 0 or value == self.result
+
+    def write_operand(self, value, out):
+        if self.kind[value] == INT:
+            out.write("$" + str(self.arg1[value]))
+        else:
+            out.write("%" + str(value))
+
+    def write(self, out):
+        out.write("ssa\n")
+        for value in range(len(self.kind)):
+            kind = self.kind[value]
+            if kind == INT or kind == NOP:
+                continue
+            out.write("\t%" + str(value) + " = ")
+            if kind == READ:
+                out.write("read_int")
+            else:
+                self.write_operand(self.arg1[value], out)
+                out.write(" + ")
+                self.write_operand(self.arg2[value], out)
+            match self.name_lst[value]:
+                case ["var", var]:
+                    out.write("\t; " + Symbols.name(var))
+                case ["reg", reg]:
+                    out.write("\t; %" + reg)
+            out.write("\n")
+        out.write("\treturn ")
+        self.write_operand(self.result, out)
+        out.write("\n")
+
+def to_ssa(bb):
+    # one walk over the flattened block. A dest that is assigned again, like
+    # rax, just names a new value; a copy of a var or an int gives its dest
+    # the value it copies, so copies are gone in SSA form
+    ssa = SSA()
+    var_value_lst = array("q", [-1]) * Symbols.symbol_num()
+    reg_value_dict = {}
+
+    def value_of(arg):
+        match arg:
+            case ["int", i]:
+                return ssa.const(i)
+            case ["var", var]:
+                return var_value_lst[var]
+            case ["reg", reg]:
+                return reg_value_dict[reg]
+
+    def define(dest, value):
+        match dest:
+            case ["var", var]:
+                var_value_lst[var] = value
+            case ["reg", reg]:
+                reg_value_dict[reg] = value
+
+    for inst in bb.inst_lst:
+        match inst:
+            case ["assign", dest, ["+", arg1, arg2]]:
+                define(dest, ssa.new_value(ADD, value_of(arg1), value_of(arg2), dest))
+            case ["assign", dest, ["func", _]]:
+                define(dest, ssa.new_value(READ, name=dest))
+            case ["call", ["func", _]]:
+                ssa.new_value(READ)
+            case ["assign", dest, src]:
+                define(dest, value_of(src))
+    ssa.result = reg_value_dict["rax"]
+    return ssa
+
+def eliminate_dead_values(ssa):
+    # sparse: only values that lose their last use are looked at again.
+    # Reads are kept for their side effect
+    work_lst = [value for value in range(len(ssa)) if ssa.kind[value] == ADD and not ssa.is_used(value)]
+    while work_lst:
+        value = work_lst.pop()
+        ssa.kind[value] = NOP
+        for arg in (ssa.arg1[value], ssa.arg2[value]):
+            ssa.use_lst[arg].remove(value)
+            if ssa.kind[arg] == ADD and not ssa.is_used(arg):
+                work_lst.append(arg)
+
+def live_ranges(ssa):
+    # a value is live from its def to its last use, the largest id in its
+    # def-use chain. -1 for values nobody uses
+    last_use_lst = array("q", [-1]) * len(ssa)
+    for value in range(len(ssa)):
+        if ssa.use_lst[value]:
+            last_use_lst[value] = max(ssa.use_lst[value])
+    if ssa.result >= 0:
+        last_use_lst[ssa.result] = len(ssa)
+    return last_use_lst
+
+def from_ssa(ssa, bb):
+    # destruction back to assigns. A value keeps the var it was defined for
+    # and gets a new tmp otherwise. The result is moved into rax last, as a
+    # later read_int call would clobber it, unless it is the last value
+    # anyway; an unused read becomes a bare call
+    name_lst = [None] * len(ssa)
+    last_value = -1
+    for value in range(len(ssa)):
+        if ssa.kind[value] in (READ, ADD):
+            last_value = value
+
+    def operand(value):
+        if ssa.kind[value] == INT:
+            return ["int", ssa.arg1[value]]
+        return name_lst[value]
+
+    bb.inst_lst = []
+    for value in range(len(ssa)):
+        kind = ssa.kind[value]
+        if kind == INT or kind == NOP:
+            continue
+        if kind == READ and not ssa.is_used(value):
+            bb.append(["call", ["func", "read_int"]])
+            continue
+        if value == ssa.result and value == last_value:
+            dest = ["reg", "rax"]
+        elif ssa.name_lst[value] is not None and ssa.name_lst[value][0] == "var":
+            dest = ssa.name_lst[value]
+        else:
+            dest = ["var", Symbols.get_new_symbol("tmp")]
+        name_lst[value] = dest
+        if kind == READ:
+            bb.append(["assign", dest, ["func", "read_int"]])
+        else:
+            bb.append(["assign", dest, ["+", operand(ssa.arg1[value]), operand(ssa.arg2[value])]])
+    if ssa.result != last_value or ssa.kind[ssa.result] == INT:
+        bb.append(["assign", ["reg", "rax"], operand(ssa.result)])
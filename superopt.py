@@ -0,0 +1,326 @@
+import argparse
+import contextlib
+import io
+import os
+
+# Offline superoptimizer for the straight line movq/addq/leaq code that
+# patch_instruction leaves. Windows are written over abstract operands:
+#   A, B  registers
+#   M, N  stack slots, never the same slot
+#   I, J  32 bit immediates, K is I + J and only shows up in replacements
+# Every location then holds a linear form over the starting values of A, B,
+# M, N and over I, J, so two sequences are equal exactly when they leave
+# the same forms in all four locations. Forms are packed into one int, a
+# byte per coefficient, so adding forms adds their coefficients; windows
+# are short enough that no coefficient reaches 256. Flags are never read
+# by our code and are not part of the state.
+#
+#   python superopt.py [--max-len 4] [--all] [source ...]
+#
+# searches all windows up to max-len instructions for a shorter equal
+# sequence, and writes the rules for windows that the compiler emits for
+# the sources (test/* by default) to superopt_rules.py, for apply_rules
+
+REG_LST = ("A", "B")
+MEM_LST = ("M", "N")
+IMM_LST = ("I", "J")
+LOC_LST = REG_LST + MEM_LST
+FORM_DICT = {"A": 1, "B": 1 << 8, "M": 1 << 16, "N": 1 << 24, "I": 1 << 32, "J": 1 << 40, "K": (1 << 32) + (1 << 40)}
+LOC_INDEX_DICT = {loc: i for i, loc in enumerate(LOC_LST)}
+START_STATE = tuple(FORM_DICT[loc] for loc in LOC_LST)
+
+def gen_inst_lst(imm_lst, with_leaq):
+    inst_lst = []
+    for op in ("movq", "addq"):
+        for src in LOC_LST + imm_lst:
+            for dest in LOC_LST:
+                if not (src in MEM_LST and dest in MEM_LST):
+                    inst_lst.append((op, src, dest))
+    if not with_leaq:
+        return inst_lst
+    for base in REG_LST:
+        for index in (None,) + REG_LST:
+            for disp in (None,) + imm_lst:
+                for dest in REG_LST:
+                    inst_lst.append(("leaq", ("lea", base, index, disp), dest))
+    return inst_lst
+
+def form(state, arg):
+    match arg:
+        case ["lea", base, index, disp]:
+            value = state[LOC_INDEX_DICT[base]]
+            if index is not None:
+                value += state[LOC_INDEX_DICT[index]]
+            if disp is not None:
+                value += FORM_DICT[disp]
+            return value
+        case _ if arg in LOC_INDEX_DICT:
+            return state[LOC_INDEX_DICT[arg]]
+        case _:
+            return FORM_DICT[arg]
+
+def run(state, inst):
+    op, src, dest = inst
+    value = form(state, src)
+    if op == "addq":
+        value += state[LOC_INDEX_DICT[dest]]
+    i = LOC_INDEX_DICT[dest]
+    return state[:i] + (value,) + state[i + 1:]
+
+def run_all(inst_lst):
+    state = START_STATE
+    for inst in inst_lst:
+        state = run(state, inst)
+    return state
+
+def shortest_dict(max_len):
+    # final state -> the shortest sequence reaching it, up to max_len
+    # instructions, breadth first so shorter sequences are seen first
+    inst_lst = gen_inst_lst(IMM_LST + ("K",), True)
+    state_dict = {START_STATE: ()}
+    level_lst = [((), START_STATE)]
+    for _ in range(max_len):
+        next_level_lst = []
+        for seq, state in level_lst:
+            for inst in inst_lst:
+                next_state = run(state, inst)
+                if next_state not in state_dict:
+                    state_dict[next_state] = seq + (inst,)
+                    next_level_lst.append((seq + (inst,), next_state))
+        level_lst = next_level_lst
+    return state_dict
+
+def operand_names(inst):
+    match inst[1]:
+        case ["lea", base, index, disp]:
+            return (base, index, disp, inst[2])
+        case src:
+            return (src, inst[2])
+
+def is_canonical(seq):
+    # B is only used after A, N after M and J after I, so each window is
+    # searched under one naming
+    seen_set = set()
+    for inst in seq:
+        for name in operand_names(inst):
+            if name == "B" and "A" not in seen_set or name == "N" and "M" not in seen_set \
+                    or name == "J" and "I" not in seen_set:
+                return False
+            seen_set.add(name)
+    return True
+
+def search(max_len):
+    # depth first over canonical windows. A window that has a shorter equal
+    # sequence is a rule and is not extended, and neither is one ending in
+    # a shorter rule window, so every rule is minimal
+    state_dict = shortest_dict(max_len - 1)
+    inst_lst = gen_inst_lst(IMM_LST, False)
+    rule_lst = []
+    work_lst = [()]
+    while work_lst:
+        seq = work_lst.pop()
+        for inst in inst_lst:
+            window = seq + (inst,)
+            if not is_canonical(window):
+                continue
+            if any(len(state_dict.get(run_all(window[i:]), window)) < len(window) - i
+                   for i in range(1, len(window))):
+                continue
+            replacement = state_dict.get(run_all(window))
+            if replacement is not None and len(replacement) < len(window):
+                rule_lst.append((window, replacement))
+            elif len(window) < max_len:
+                work_lst.append(window)
+    rule_lst.sort(key=lambda rule: (len(rule[0]), len(rule[1]), repr(rule)))
+    return rule_lst
+
+def write_rules(rule_lst, out):
+    out.write("# written by superopt.py, (window, replacement) pairs over the operands\n")
+    out.write("# A, B (registers), M, N (stack slots), I, J (immediates) and K = I + J\n")
+    out.write("RULE_LST = [\n")
+    for window, replacement in rule_lst:
+        out.write("    (" + repr(window) + ",\n     " + repr(replacement) + "),\n")
+    out.write("]\n")
+
+def to_tuple(operand):
+    return tuple(operand)
+
+def is_imm32(i):
+    return -(1 << 31) <= i < (1 << 31)
+
+def bind(name, operand, binding_dict):
+    # binds an abstract operand to a concrete one, registers and slots one
+    # to one; returns False when they do not fit
+    if name is None or operand is None:
+        return name is None and operand is None
+    if name in binding_dict:
+        return binding_dict[name] == operand
+    match operand:
+        case ["reg", _] if name in REG_LST:
+            pass
+        case ["deref", _, _] if name in MEM_LST:
+            pass
+        case ["int", i] if name in IMM_LST and is_imm32(i):
+            pass
+        case _:
+            return False
+    if name not in IMM_LST and operand in binding_dict.values():
+        return False
+    binding_dict[name] = operand
+    return True
+
+def match_window(window, inst_lst, binding_dict):
+    for pattern, inst in zip(window, inst_lst):
+        if len(inst) != 3 or pattern[0] != inst[0]:
+            return False
+        match pattern[1], inst[1]:
+            case ["lea", base, index, disp], ["lea", reg, index_reg, offset]:
+                if not (bind(base, ("reg", reg), binding_dict)
+                        and bind(index, None if index_reg is None else ("reg", index_reg), binding_dict)
+                        and bind(disp, None if offset is None else ("int", offset), binding_dict)):
+                    return False
+            case ["lea", _, _, _], _:
+                return False
+            case name, operand:
+                if not bind(name, to_tuple(operand), binding_dict):
+                    return False
+        if not bind(pattern[2], to_tuple(inst[2]), binding_dict):
+            return False
+    return True
+
+def concrete(name, binding_dict):
+    if name == "K":
+        return ["int", binding_dict["I"][1] + binding_dict["J"][1]]
+    return list(binding_dict[name])
+
+def build(replacement, binding_dict):
+    inst_lst = []
+    for op, src, dest in replacement:
+        match src:
+            case ["lea", base, index, disp]:
+                src = ["lea", binding_dict[base][1],
+                       None if index is None else binding_dict[index][1],
+                       None if disp is None else concrete(disp, binding_dict)[1]]
+            case _:
+                src = concrete(src, binding_dict)
+        inst_lst.append([op, src, concrete(dest, binding_dict)])
+    for inst in inst_lst:
+        for operand in inst[1:]:
+            if operand[0] == "int" and not is_imm32(operand[1]) \
+                    or operand[0] == "lea" and operand[3] is not None and not is_imm32(operand[3]):
+                return None
+    return inst_lst
+
+RULE_DICT = None
+
+def load_rules():
+    # first ops of a window -> its rules, longest window first
+    global RULE_DICT
+    from superopt_rules import RULE_LST
+    RULE_DICT = {}
+    for window, replacement in sorted(RULE_LST, key=lambda rule: -len(rule[0])):
+        RULE_DICT.setdefault(tuple(inst[0] for inst in window), []).append((window, replacement))
+    return RULE_DICT
+
+def apply_rules(bb):
+    # peephole pass over the block: at each place the longest matching
+    # window is replaced, then matching goes back far enough to see
+    # windows the replacement completed
+    rule_dict = RULE_DICT if RULE_DICT is not None else load_rules()
+    max_len = max(len(ops) for ops in rule_dict)
+    inst_lst = list(bb.inst_lst)
+    i = 0
+    while i < len(inst_lst):
+        for length in range(min(max_len, len(inst_lst) - i), 1, -1):
+            window_inst_lst = inst_lst[i:i + length]
+            replacement_lst = None
+            for window, replacement in rule_dict.get(tuple(inst[0] for inst in window_inst_lst), ()):
+                binding_dict = {}
+                if match_window(window, window_inst_lst, binding_dict):
+                    replacement_lst = build(replacement, binding_dict)
+                    if replacement_lst is not None:
+                        break
+            if replacement_lst is not None:
+                inst_lst[i:i + length] = replacement_lst
+                i = max(0, i - max_len + 1)
+                break
+        else:
+            i += 1
+    bb.inst_lst = inst_lst
+
+def abstract_window(inst_lst):
+    # the canonical window of concrete instructions, None if it uses
+    # anything but movq/addq or more than two registers, slots or ints
+    name_dict = {}
+    window = []
+    for inst in inst_lst:
+        if len(inst) != 3 or inst[0] not in ("movq", "addq"):
+            return None
+        names = []
+        for operand in inst[1:]:
+            operand = to_tuple(operand)
+            if operand not in name_dict:
+                match operand:
+                    case ["reg", _]:
+                        name_lst = REG_LST
+                    case ["deref", _, _]:
+                        name_lst = MEM_LST
+                    case ["int", i] if is_imm32(i):
+                        name_lst = IMM_LST
+                    case _:
+                        return None
+                used_num = sum(1 for name in name_dict.values() if name in name_lst)
+                if used_num == len(name_lst):
+                    return None
+                name_dict[operand] = name_lst[used_num]
+            names.append(name_dict[operand])
+        window.append((inst[0], names[0], names[1]))
+    return tuple(window)
+
+def hot_windows(source_lst, max_len):
+    # the windows of the code let_lan.py emits for source_lst at -O0 and
+    # -O1, taken from compile_to_block with the driver's own args so every
+    # pass that runs there runs here, then homes and patches as main does
+    from let_lan import make_arg_parser, compile_to_block, StackFrame, assign_home, patch_instruction
+    from printer import Dumper
+    from symbols import Symbols
+    window_set = set()
+    for source in source_lst:
+        for opt_level in (0, 1):
+            Symbols.reset()
+            args = make_arg_parser().parse_args([source, "-O", str(opt_level)])
+            with contextlib.redirect_stdout(io.StringIO()):    # a constant's main
+                bb = compile_to_block(args, Dumper(0, None))
+            if bb is None:
+                continue
+            assign_home(bb, StackFrame())
+            patch_instruction(bb)
+            for i in range(len(bb.inst_lst)):
+                for length in range(1, min(max_len, len(bb.inst_lst) - i) + 1):
+                    window = abstract_window(bb.inst_lst[i:i + length])
+                    if window is not None:
+                        window_set.add(window)
+    return window_set
+
+def main():
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("source", nargs="*", help="programs whose windows to keep rules for, test/* if none")
+    arg_parser.add_argument("--max-len", type=int, default=4, help="longest window to search")
+    arg_parser.add_argument("--all", action="store_true", help="keep every rule, not only the ones for windows "
+                                                                "that show up in the sources")
+    arg_parser.add_argument("-o", "--output", default="superopt_rules.py")
+    args = arg_parser.parse_args()
+    rule_lst = search(args.max_len)
+    print("{} rules".format(len(rule_lst)))
+    if not args.all:
+        source_lst = args.source or sorted(os.path.join("test", name) for name in os.listdir("test"))
+        window_set = hot_windows(source_lst, args.max_len)
+        rule_lst = [rule for rule in rule_lst if rule[0] in window_set]
+        print("{} rules for the windows of {} programs".format(len(rule_lst), len(source_lst)))
+    out = io.StringIO()
+    write_rules(rule_lst, out)
+    with open(args.output, "w") as f:
+        f.write(out.getvalue())
+
+if __name__ == "__main__":
+    main()
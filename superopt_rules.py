@@ -0,0 +1,14 @@
+# written by superopt.py, (window, replacement) pairs over the operands
+# A, B (registers), M, N (stack slots), I, J (immediates) and K = I + J
+RULE_LST = [
+    ((('movq', 'A', 'M'), ('movq', 'M', 'A')),
+     (('movq', 'A', 'M'),)),
+    ((('movq', 'A', 'M'), ('addq', 'I', 'M'), ('movq', 'M', 'A')),
+     (('addq', 'I', 'A'), ('movq', 'A', 'M'))),
+    ((('movq', 'M', 'A'), ('movq', 'A', 'N'), ('movq', 'M', 'A')),
+     (('movq', 'M', 'A'), ('movq', 'A', 'N'))),
+    ((('movq', 'A', 'M'), ('movq', 'N', 'A'), ('addq', 'A', 'M'), ('movq', 'M', 'A')),
+     (('addq', 'N', 'A'), ('movq', 'A', 'M'))),
+    ((('movq', 'I', 'M'), ('movq', 'M', 'A'), ('movq', 'A', 'N'), ('addq', 'J', 'N')),
+     (('movq', 'I', 'A'), ('movq', 'A', 'M'), ('movq', 'K', 'N'))),
+]
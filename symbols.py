@@ -0,0 +1,58 @@
+from array import array
+
+class Symbols:
+    # symbols are dense int ids, "var.n" names are only built for debug output
+    symbol_dict = {}
+    var_lst = []
+    count_lst = array("q")
+
+    @staticmethod
+    def get_new_symbol(var):
+        if var not in Symbols.symbol_dict:
+            Symbols.symbol_dict[var] = 1
+        else:
+            Symbols.symbol_dict[var] += 1
+        Symbols.var_lst.append(var)
+        Symbols.count_lst.append(Symbols.symbol_dict[var])
+        return len(Symbols.var_lst) - 1
+
+    @staticmethod
+    def reset():
+        Symbols.symbol_dict = {}
+        Symbols.var_lst = []
+        Symbols.count_lst = array("q")
+
+    @staticmethod
+    def symbol_num():
+        return len(Symbols.var_lst)
+
+    @staticmethod
+    def name(symbol):
+        return Symbols.var_lst[symbol] + "." + str(Symbols.count_lst[symbol])
+
+class ScopedEnv:
+    # name -> stack of renamings, innermost last, plus an undo log of the
+    # names bound so far so leaving a scope pops just its own binding
+
+    def __init__(self):
+        self.scope_dict = {}
+        self.undo_lst = []
+
+    def bind(self, key, new_name):
+        if key not in self.scope_dict:
+            self.scope_dict[key] = [new_name]
+        else:
+            self.scope_dict[key].append(new_name)
+        self.undo_lst.append(key)
+
+    def unbind(self):
+        key = self.undo_lst.pop()
+        name_stack = self.scope_dict[key]
+        name_stack.pop()
+        if len(name_stack) == 0:
+            del self.scope_dict[key]
+
+    def find(self, key):
+        if key not in self.scope_dict:
+            raise NameError("Unify Err: Unbound var {}".format(key))
+        return self.scope_dict[key][-1]